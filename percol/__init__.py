@@ -5,13 +5,17 @@ __doc__     = info.__doc__
 __version__ = info.__version__
 __logo__    = info.__logo__
 
+# imported first, as it marks when percol starts
+from percol import debug
+
+import os
+import re
 import sys
 import signal
 import curses
-import threading
 import six
 
-from percol import debug, action
+from percol import action
 
 from percol.display import Display
 from percol.finder  import FinderMultiQueryString
@@ -19,6 +23,13 @@ from percol.key     import KeyHandler
 from percol.model   import SelectorModel
 from percol.view    import SelectorView
 from percol.command import SelectorCommand
+from percol.scheduler import FrameScheduler, SearchWorker
+from percol.eventloop import EventLoop
+
+def get_terminal_size(fd):
+    import fcntl, termios, struct
+    height, width = struct.unpack("hh", fcntl.ioctl(fd, termios.TIOCGWINSZ, b"1234"))
+    return height, width
 
 class TerminateLoop(Exception):
     def __init__(self, value):
@@ -33,8 +44,10 @@ class Percol(object):
                  candidates = None, actions = None,
                  query = None, caret = None, index = None):
         # initialization
-        self.global_lock = threading.Lock()
         self.encoding = encoding
+        # other threads pass their results to the main thread via the
+        # event loop
+        self.event_loop = EventLoop()
 
         if descriptors is None:
             self.stdin  = sys.stdin
@@ -54,7 +67,10 @@ class Percol(object):
 
         # wraps candidates (iterator)
         from percol.lazyarray import LazyArray
-        self.candidates = LazyArray(candidates or [])
+        if isinstance(candidates, LazyArray):
+            self.candidates = candidates
+        else:
+            self.candidates = LazyArray(candidates or [])
         self.has_no_candidate = self.candidates.has_nth_value(0)
         self.has_only_one_candidate = self.candidates.has_nth_value(0) and not self.candidates.has_nth_value(1)
 
@@ -78,13 +94,18 @@ class Percol(object):
 
         # create view
         self.view = SelectorView(percol = self)
+        self.frame_scheduler = FrameScheduler(self.view.refresh_display)
+        self.search_worker = SearchWorker(on_finish = self.handle_search_result)
 
         # create command
         self.command_candidate = SelectorCommand(self.model_candidate, self.view)
         self.command_action = SelectorCommand(self.model_action, self.view)
 
-        # suppress SIGINT termination
-        signal.signal(signal.SIGINT, lambda signum, frame: None)
+        # suppress SIGINT termination (C-c wakes up the main loop and
+        # is handled as a key)
+        signal.signal(signal.SIGINT, self.handle_sigint)
+        # the main loop resizes the screen by itself
+        signal.signal(signal.SIGWINCH, self.handle_sigwinch)
 
         # handle special keys like <f1>, <down>, ...
         self.screen.keypad(True)
@@ -95,28 +116,60 @@ class Percol(object):
         # Leave newline mode. Make percol distinguish between "C-m" and "C-j".
         curses.nonl()
 
+        if self.bracketed_paste:
+            os.write(self.SCREEN_OUTPUT_FD, b"\x1b[?2004h")
+
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.bracketed_paste:
+            os.write(self.SCREEN_OUTPUT_FD, b"\x1b[?2004l")
         # Back to newline mode (TODO: is it needed?).
         curses.nl()
         curses.endwin()
+        self.event_loop.close()
         self.execute_action()
 
+    # make the terminal mark pasted text, so that it is inserted into
+    # the query at once (and never taken as commands)
+    bracketed_paste = True
+
     args_for_action = None
 
     def execute_action(self):
         selected_actions = self.model_action.get_selected_results_with_index()
 
-        if selected_actions and self.args_for_action:
+        if selected_actions and self.has_args_for_action():
             for name, _, act_idx in selected_actions:
                 try:
                     action = self.actions[act_idx]
                     if action:
-                        action.act([arg for arg, _, _ in self.args_for_action], self)
+                        args = self.iter_args_for_action()
+                        if not action.streaming:
+                            args = list(args)
+                        action.act(args, self)
                 except Exception as e:
                     debug.log("execute_action", e)
 
+    def has_args_for_action(self):
+        # args_for_action is set only when finished (not canceled)
+        if self.args_for_action is None:
+            return False
+        for result in self.args_for_action():
+            return True
+        return False
+
+    def iter_args_for_action(self):
+        for arg, _, idx in self.args_for_action():
+            yield self.format_arg_for_action(arg, idx)
+
+    def format_arg_for_action(self, arg, index):
+        """
+        Override this to decorate each line passed to actions
+        (`index` is the position of the line in the candidates)
+        """
+        return arg
+
     # ============================================================ #
     # Statuses
     # ============================================================ #
@@ -148,37 +201,241 @@ class Percol(object):
     # Main Loop
     # ============================================================ #
 
+    # debounce delay of searches until their cost is measured (see
+    # percol.scheduler.SearchWorker)
     SEARCH_DELAY = 0.05
 
+    # curses reads keys from the standard input, and writes to the
+    # standard output
+    KEY_INPUT_FD = 0
+    SCREEN_OUTPUT_FD = 1
+
     def loop(self):
-        self.view.refresh_display()
-        self.result_updating_timer = None
+        self.frame_scheduler.draw_now()
+        debug.mark_startup("first frame")
+        # SEARCH_DELAY may be changed in rc.py
+        self.search_worker.delay = self.SEARCH_DELAY
+
+        # keys are read without blocking when the tty becomes readable
+        self.screen.timeout(0)
+        self.event_loop.add_reader(self.KEY_INPUT_FD, self.handle_keys)
+        if self.candidate_feed is not None:
+            self.candidate_feed.on_update = self.notify_candidate_feed
+        # feeds with a descriptor (e.g., percol.source.StreamFeed) are
+        # read when it becomes readable
+        candidate_input_fd = self.get_candidate_input_fd()
+        if candidate_input_fd is not None:
+            self.event_loop.add_reader(candidate_input_fd, self.handle_candidate_input)
+
+        try:
+            while True:
+                self.event_loop.run_once(self.frame_scheduler.time_until_next_frame())
+                if self.interrupted:
+                    # C-c (-1 is the key for SIGINT)
+                    self.interrupted = False
+                    self.handle_input(-1)
+                if self.resized:
+                    self.resized = False
+                    self.resize_screen()
+                self.frame_scheduler.draw_if_due()
+        except TerminateLoop as e:
+            return e.value
+        finally:
+            self.event_loop.remove_reader(self.KEY_INPUT_FD)
+            if candidate_input_fd is not None:
+                self.event_loop.remove_reader(candidate_input_fd)
+            if self.candidate_feed is not None:
+                self.candidate_feed.on_update = None
+
+    def handle_keys(self):
+        """
+        Handles all keys available without blocking. Characters typed
+        (or pasted) in a burst are inserted into the query at once, so
+        that the burst results in a search and a frame.
+        """
+        text = []
+        while True:
+            ch = self.screen.getch()
+            if ch == -1:
+                break
+            if self.pasting:
+                text.append(self.read_paste(ch))
+            elif self.keyhandler.is_paste_begin(ch):
+                text.append(self.read_paste())
+            elif self.is_text_key(ch):
+                text.append(self.read_text_key(ch))
+            else:
+                self.insert_text(text)
+                self.handle_input(ch)
+        self.insert_text(text)
+
+    def is_text_key(self, ch):
+        if self.keyhandler.is_displayable_key(ch):
+            # keys bound to commands are not text
+            return self.keyhandler.displayable_key_to_str(ch) not in self.keymap
+        return ch <= 0xff and self.keyhandler.is_utf8_multibyte_key(ch)
+
+    def read_text_key(self, ch):
+        if self.keyhandler.is_displayable_key(ch):
+            self.last_key = self.keyhandler.displayable_key_to_str(ch)
+            return six.unichr(ch)
+        # rest of the character is waited for
+        self.screen.timeout(-1)
+        try:
+            ukey = self.keyhandler.get_utf8_key_for(ch)
+        finally:
+            self.screen.timeout(0)
+        self.last_key = ukey.encode(self.encoding)
+        return ukey
+
+    # milliseconds to wait for the rest of pasted text (the rest is
+    # read when it comes, if it takes longer)
+    PASTE_TIMEOUT = 100
+
+    pasting = False
+
+    def read_paste(self, ch = None):
+        self.screen.timeout(self.PASTE_TIMEOUT)
+        try:
+            pasted, finished = self.keyhandler.read_paste(ch)
+        finally:
+            self.screen.timeout(0)
+        self.pasting = not finished
+        pasted = pasted.decode(self.encoding, "replace")
+        if finished:
+            pasted = pasted.rstrip(u"\r\n")
+        # the query is a line
+        return re.sub(u"[\r\n\t]+", u" ", pasted)
+
+    def insert_text(self, text):
+        if not text:
+            return
+        self.model.insert_string(u"".join(text))
+        del text[:]
+        if self.model.should_search_again():
+            self.search_worker.request(self.model)
+        self.frame_scheduler.request()
+
+    def handle_input(self, ch):
+        # rest of the key (e.g., after ESC) is waited for
+        self.screen.timeout(-1)
+        try:
+            self.handle_key(ch)
+        finally:
+            self.screen.timeout(0)
+
+        if self.model.should_search_again():
+            # search again (with bounce)
+            self.search_worker.request(self.model)
+
+        self.frame_scheduler.request()
+
+    def call_in_main_thread(self, callback):
+        """
+        Runs `callback` in the main loop (thread-safe)
+        """
+        self.event_loop.call_soon_threadsafe(callback)
 
-        def search_and_refresh_display():
-            self.model.do_search(self.model.query)
-            self.view.refresh_display()
+    def request_redraw(self):
+        """
+        Asks the main loop to redraw the screen (thread-safe)
+        """
+        self.call_in_main_thread(self.request_frame)
 
-        while True:
-            try:
-                self.handle_key(self.screen.getch())
-
-                if self.model.should_search_again():
-                    # search again
-                    with self.global_lock:
-                        # critical section
-                        if not self.result_updating_timer is None:
-                            # clear timer
-                            self.result_updating_timer.cancel()
-                            self.result_updating_timer = None
-
-                        # with bounce
-                        t = threading.Timer(self.SEARCH_DELAY, search_and_refresh_display)
-                        self.result_updating_timer = t
-                        t.start()
-
-                self.view.refresh_display()
-            except TerminateLoop as e:
-                return e.value
+    def request_frame(self):
+        self.frame_scheduler.request()
+
+    def handle_search_result(self, model, snapshot):
+        # called from the search worker
+        self.call_in_main_thread(lambda: self.apply_search_result(model, snapshot))
+
+    def apply_search_result(self, model, snapshot):
+        if model.apply_snapshot(snapshot):
+            self.frame_scheduler.request()
+
+    # ============================================================ #
+    # Preview
+    # ============================================================ #
+
+    previewer = None
+
+    def set_preview(self, command, position = "right", ratio = 0.5):
+        """
+        Shows the preview of the selected candidate in a pane at
+        `position` ("right" or "bottom") which takes `ratio` of the
+        screen. `command` is a callable (candidate => text) or a shell
+        command (see percol.preview.Previewer). None hides the pane.
+        """
+        if self.previewer is not None:
+            self.previewer.cancel()
+        if command is None:
+            self.previewer = None
+            self.display.set_preview_pane(None)
+        else:
+            # not imported until a preview is requested
+            from percol.preview import Previewer
+            self.previewer = Previewer(command, self.encoding, on_update = self.request_redraw)
+            self.display.set_preview_pane(position, ratio)
+        self.view.invalidate_display()
+        self.request_redraw()
+
+    # ============================================================ #
+    # Candidate feed
+    # ============================================================ #
+
+    # an object whose get_new_lines() returns candidates appended
+    # after start-up (e.g., percol.source.FileFollower)
+    candidate_feed = None
+
+    def notify_candidate_feed(self):
+        # called from the thread of the feed
+        self.event_loop.call_soon_threadsafe(self.handle_candidate_feed)
+
+    def handle_candidate_feed(self):
+        if self.poll_candidate_feed():
+            self.frame_scheduler.request()
+
+    def get_candidate_input_fd(self):
+        if self.candidate_feed is None or not hasattr(self.candidate_feed, "fileno") \
+           or self.candidate_feed.closed:
+            return None
+        return self.candidate_feed.fileno()
+
+    def handle_candidate_input(self):
+        self.handle_candidate_feed()
+        if self.candidate_feed.closed:
+            self.event_loop.remove_reader(self.candidate_feed.fileno())
+
+    def poll_candidate_feed(self):
+        # feeds may also replace candidates as a whole (e.g.,
+        # percol.procs.ProcessList)
+        get_replacement = getattr(self.candidate_feed, "get_replacement", None)
+        replacement = get_replacement() if get_replacement else None
+        if replacement is not None:
+            self.replace_candidates(replacement,
+                                    getattr(self.candidate_feed, "get_line_key", None))
+            return True
+        new_lines = self.candidate_feed.get_new_lines()
+        # the last line may have been continued (e.g., a line being
+        # written by percol.source.FileFollower)
+        get_changed_last_line = getattr(self.candidate_feed, "get_changed_last_line", None)
+        changed_last_line = get_changed_last_line() if get_changed_last_line else None
+        if changed_last_line is not None:
+            self.candidates.replace_last(changed_last_line)
+            self.model_candidate.update_last_candidate()
+        elif not new_lines:
+            return False
+        if new_lines:
+            self.candidates.extend(new_lines)
+            self.model_candidate.append_candidates()
+        return True
+
+    def replace_candidates(self, lines, get_key = None):
+        """
+        Replaces candidates with `lines` (see SelectorModel.replace_collection)
+        """
+        self.candidates = lines
+        self.model_candidate.replace_collection(lines, get_key)
 
     # ============================================================ #
     # Key Handling
@@ -221,6 +478,22 @@ class Percol(object):
         for key, cmd in six.iteritems(keymap):
             self.keymap[key] = cmd
 
+    interrupted = False
+    def handle_sigint(self, signum, frame):
+        self.interrupted = True
+        self.event_loop.wakeup()
+
+    resized = False
+    def handle_sigwinch(self, signum, frame):
+        self.resized = True
+        self.event_loop.wakeup()
+
+    def resize_screen(self):
+        height, width = get_terminal_size(self.KEY_INPUT_FD)
+        # resizeterm() queues KEY_RESIZE, which is handled as a key
+        curses.resizeterm(height, width)
+        self.handle_keys()
+
     # default
     last_key = None
     def handle_key(self, ch):
@@ -233,8 +506,8 @@ class Percol(object):
 
     def handle_resize(self, ch):
         self.display.update_screen_size()
-        # XXX: trash -1 (it seems that resize key sends -1)
-        self.keyhandler.get_key_for(self.screen.getch())
+        self.view.invalidate_display()
+        self.frame_scheduler.request()
         return key.SPECIAL_KEYS[ch]
 
     def handle_utf8(self, ch):
@@ -261,8 +534,9 @@ class Percol(object):
     def cancel(self):
         raise TerminateLoop(self.cancel_with_exit_code())          # failure
 
-    def finish_with_exit_code(self, value):
-        self.args_for_action = self.model_candidate.get_selected_results_with_index()
+    def finish_with_exit_code(self, value = 0):
+        # selected candidates are streamed to actions later (in execute_action)
+        self.args_for_action = self.model_candidate.iter_selected_results_with_index
         return value
 
     def cancel_with_exit_code(self):
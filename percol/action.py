@@ -5,10 +5,18 @@
 # ============================================================ #
 
 class Action(object):
+    """
+    An action is called as `act(lines, percol)` with the selected lines.
+    `lines` is a list, unless the action is defined with
+    `@action(streaming = True)`; then it is an iterable which yields
+    lines lazily and can be iterated only once (no indexing nor len()).
+    """
+
     def __init__(self, desc, act, args):
         self.act  = act
         self.desc = desc
         self.args = args
+        self.streaming = args.get("streaming", False)
 
 def action(**args):
     def act_handler(act):
@@ -2,6 +2,8 @@
 
 import sys, six
 
+from itertools import islice
+
 from percol.action import action
 
 def double_quote_string(string):
@@ -13,23 +15,36 @@ def get_raw_stream(stream):
     else:
         return stream.buffer
 
-@action()
+# number of lines encoded and written at once
+OUTPUT_BATCH_SIZE = 4096
+
+def write_lines(lines, encoding, stream = None, batch_size = OUTPUT_BATCH_SIZE):
+    """
+    Writes lines to the raw stream of `stream` (sys.stdout by
+    default). Lines are joined and encoded in batches so that huge
+    selections are flushed with a few write calls.
+    """
+    stdout = get_raw_stream(stream or sys.stdout)
+    lines = iter(lines)
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            break
+        chunk = u"\n".join(batch) + u"\n"
+        stdout.write(chunk.encode(encoding) if isinstance(chunk, six.text_type) else chunk)
+    stdout.flush()
+
+@action(streaming = True)
 def output_to_stdout(lines, percol):
     "output marked (selected) items to stdout"
-    stdout = get_raw_stream(sys.stdout)
-    for line in lines:
-        stdout.write(percol.display.get_raw_string(line))
-        stdout.write(six.b("\n"))
+    write_lines(lines, percol.encoding)
 
-@action()
+@action(streaming = True)
 def output_to_stdout_double_quote(lines, percol):
     "output marked (selected) items to stdout with double quotes"
-    stdout = get_raw_stream(sys.stdout)
-    for line in lines:
-        stdout.write(percol.display.get_raw_string(double_quote_string(line)))
-        stdout.write(six.b("\n"))
+    write_lines((double_quote_string(line) for line in lines), percol.encoding)
 
-@action()
+@action(streaming = True)
 def no_output(lines, percol):
     "ignore all output"
     pass
@@ -2,7 +2,9 @@
 
 import sys
 import os
+import stat
 import locale
+import errno
 import six
 
 from optparse import OptionParser
@@ -13,7 +15,7 @@ from percol import tty
 from percol import debug
 from percol import ansi
 
-INSTRUCTION_TEXT = ansi.markup("""<bold><blue>{logo}</blue></bold>
+INSTRUCTION_TEXT = """<bold><blue>{logo}</blue></bold>
                                 <on_blue><underline> {version} </underline></on_blue>
 
 You did not give any inputs to <underline>percol</underline>. Check following typical usages and try again.
@@ -26,8 +28,12 @@ You did not give any inputs to <underline>percol</underline>. Check following ty
 
  $ ps aux | <underline>percol</underline>
 
-""").format(logo = percol.__logo__,
-            version = percol.__version__)
+"""
+
+def get_instruction_text():
+    # marked up only when shown
+    return ansi.markup(INSTRUCTION_TEXT).format(logo = percol.__logo__,
+                                                version = percol.__version__)
 
 class LoadRunCommandFileError(Exception):
     def __init__(self, error):
@@ -45,14 +51,50 @@ def create_default_rc_file():
     with open(DEFAULT_CONF_PATH, "w+") as file:
         file.write("# Run command file for percol\n")
 
+def get_rc_cache_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, "__pycache__", filename + ".cache")
+
+def compile_rc(path):
+    """
+    Returns the code object of the run-command file at `path`. Compiled
+    code is cached beside the file and reused while the file (and the
+    Python version) stays the same.
+    """
+    if not os.path.isfile(path):
+        # e.g., --rcfile <(command)
+        with open(path, "rb") as file:
+            return compile(file.read(), path, 'exec')
+    import marshal
+    st = os.stat(path)
+    stamp = [sys.version, os.path.abspath(path), st.st_size, st.st_mtime]
+    cache_path = get_rc_cache_path(path)
+    try:
+        with open(cache_path, "rb") as cache_file:
+            cached = marshal.loads(cache_file.read())
+        if list(cached[:-1]) == stamp:
+            return cached[-1]
+    except Exception:
+        # no cache yet (or a broken one)
+        pass
+    with open(path, "rb") as file:
+        code = compile(file.read(), path, 'exec')
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        with open(cache_path, "wb") as cache_file:
+            cache_file.write(marshal.dumps(tuple(stamp + [code])))
+    except (IOError, OSError) as e:
+        debug.log("compile_rc", e)
+    return code
+
 def load_rc(percol, path = None, encoding = 'utf-8'):
     if path is None:
         if not os.path.exists(DEFAULT_CONF_PATH):
             create_default_rc_file()
         path = DEFAULT_CONF_PATH
     try:
-        with open(path, "rb") as file:
-            exec(compile(file.read(), path, 'exec'), locals())
+        exec(compile_rc(path), locals())
     except Exception as e:
         raise LoadRunCommandFileError(e)
 
@@ -119,6 +161,31 @@ def setup_options(parser):
                       help = "exit immediately with doing nothing to cache module files and speed up start-up time")
     parser.add_option("--select-ignore", dest="select_ignore",
                       help="lines that match regex cannot be selected")
+    parser.add_option("--with-filename", dest = "with_filename", default = False, action="store_true",
+                      help = "prefix each output line with its file name and line number (FILE:LINE:)")
+    parser.add_option("--fps", dest = "fps", type = "float",
+                      help = "maximum number of screen updates per second (default 60, 0 for unlimited)")
+    parser.add_option("--filter", dest = "filter", metavar = "QUERY",
+                      help = "write lines matching QUERY to stdout without the interactive interface")
+    parser.add_option("--source", dest = "source", metavar = "SOURCE",
+                      help = "read candidates from SOURCE instead of FILEs: zsh-history[:HISTFILE] or bash-history[:HISTFILE] (newest first, without duplicates), files[:ROOT] or dirs[:ROOT] (paths under ROOT), procs (processes like `ps aux`)")
+    parser.add_option("--prune", dest = "prune", metavar = "GLOB", action = "append",
+                      help = "do not enter directories matching GLOB with --source files / dirs (.git, node_modules, ... are always pruned)")
+    parser.add_option("--refresh", dest = "refresh", type = "float", metavar = "SECONDS",
+                      help = "read the SOURCE again every SECONDS (for --source procs)")
+    parser.add_option("--follow", dest = "follow", default = False, action="store_true",
+                      help = "keep reading lines appended to FILE (like `tail -f`)")
+    parser.add_option("--preview", dest = "preview", metavar = "COMMAND",
+                      help = "show the output of COMMAND for the selected line ({} is replaced with the quoted line)")
+    parser.add_option("--preview-position", dest = "preview_position", default = "right",
+                      choices = ("right", "bottom"),
+                      help = "where the preview is shown (right or bottom)")
+    parser.add_option("--startup-trace", dest = "startup_trace", default = False, action="store_true",
+                      help = "print how long each step took until the first frame (to stderr, on exit)")
+    parser.add_option("--server", dest = "server", default = False, action="store_true",
+                      help = "keep running and serve `percol --client` with warm modules and FILEs")
+    parser.add_option("--client", dest = "client", default = False, action="store_true",
+                      help = "let a running `percol --server` do the work (runs normally without a server)")
 
 def set_proper_locale(options):
     try:
@@ -130,27 +197,155 @@ def set_proper_locale(options):
         output_encoding = options.output_encoding
     return output_encoding
 
-def read_input(filename, encoding, reverse=False):
+def read_input(filename, encoding, reverse=False, buffer_size=-1):
     import codecs
-    if filename:
-        if six.PY2:
-            stream = codecs.getreader(encoding)(open(filename, "r"), "replace")
-        else:
-            stream = open(filename, "r", encoding=encoding)
+    from percol import source
+    compression = source.guess_compression(filename) if filename else None
+    if compression:
+        # decompress in a background thread
+        stream = source.open_compressed(filename, compression)
+        lines = source.iter_lines_from_blocks(source.iter_blocks_in_background(stream), encoding)
+        if reverse:
+            lines = reversed(list(lines))
     else:
-        if six.PY2:
-            stream = codecs.getreader(encoding)(sys.stdin, "replace")
+        if filename:
+            if six.PY2:
+                stream = codecs.getreader(encoding)(open(filename, "r", buffer_size), "replace")
+            else:
+                stream = open(filename, "r", encoding=encoding, buffering=buffer_size)
         else:
-            import io
-            stream = io.TextIOWrapper(sys.stdin.buffer, encoding=encoding)
-    if reverse:
-        lines = reversed(stream.readlines())
-    else:
-        lines = stream
+            if six.PY2:
+                stream = codecs.getreader(encoding)(sys.stdin, "replace")
+            else:
+                import io
+                if buffer_size > 0:
+                    raw_stdin = io.open(sys.stdin.fileno(), "rb", buffering=buffer_size, closefd=False)
+                else:
+                    raw_stdin = sys.stdin.buffer
+                stream = io.TextIOWrapper(raw_stdin, encoding=encoding)
+        if reverse:
+            lines = reversed(stream.readlines())
+        else:
+            lines = stream
     for line in lines:
         yield ansi.remove_escapes(line.rstrip("\r\n"))
     stream.close()
 
+def read_candidates(filenames, options, buffer_size=-1, corpus_cache=None, stream_stdin=False):
+    """
+    Returns (candidates, file_reader, follower) for FILE arguments
+    (or stdin when no file is given). With `stream_stdin`, a pipe
+    given to stdin is read by the event loop (through the follower).
+    """
+    input_encoding = options.input_encoding
+    file_reader = None
+    follower = None
+    if options.source and options.refresh:
+        from percol import source
+        # the feed replaces candidates later
+        follower = source.open_refreshed_source(options.source, input_encoding, options.refresh)
+        candidates = follower.iter_lines()
+    elif options.source:
+        from percol import source
+        candidates = source.open_source(options.source, input_encoding, options.prune)
+        if options.reverse:
+            candidates = reversed(list(candidates))
+    elif is_corpus_request(filenames, options, corpus_cache):
+        candidates = corpus_cache.get(filenames[0], input_encoding, options.reverse)
+    elif options.follow:
+        from percol.source import FileFollower
+        follower = FileFollower(filenames[0], input_encoding, line_filter = ansi.remove_escapes)
+        candidates = follower.iter_lines()
+        # it also tells line numbers (for --with-filename)
+        file_reader = follower
+    elif stream_stdin and can_stream_stdin(filenames, options):
+        from percol.source import StreamFeed
+        follower = StreamFeed(lambda: sys.stdin.fileno(), input_encoding,
+                              line_filter = ansi.remove_escapes)
+        candidates = follower.iter_lines()
+    elif len(filenames) > 1 or (filenames and options.with_filename):
+        from percol.source import MultiFileReader
+        file_reader = MultiFileReader(filenames,
+                                      lambda filename: read_input(filename, input_encoding,
+                                                                  buffer_size=buffer_size))
+        candidates = file_reader.iter_lines(reverse=options.reverse)
+    else:
+        filename = filenames[0] if filenames else None
+        candidates = read_input(filename, input_encoding, reverse=options.reverse,
+                                buffer_size=buffer_size)
+    return candidates, file_reader, follower
+
+def can_stream_stdin(filenames, options):
+    # options which need the whole input at start-up read it at once
+    if filenames or options.reverse or options.auto_fail or options.auto_match or \
+       options.index not in (None, "first"):
+        return False
+    try:
+        return not stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode)
+    except (OSError, ValueError):
+        return False
+
+def is_corpus_request(filenames, options, corpus_cache):
+    # a single file read as a whole can be kept by the server
+    return (corpus_cache is not None and len(filenames) == 1 and
+            not options.follow and not options.with_filename and
+            corpus_cache.can_cache(filenames[0]))
+
+def serve(filenames, options):
+    """
+    Runs `percol --server`. FILEs are loaded in advance.
+    """
+    from percol.server import Server, CorpusCache
+
+    class RequestOptionParser(OptionParser):
+        # options of clients are reported by the forked child (on the
+        # client's terminal); the server neither prints nor exits
+        def print_usage(self, file = None):
+            pass
+
+        def print_help(self, file = None):
+            pass
+
+        def print_version(self, file = None):
+            pass
+
+        def exit(self, status = 0, msg = None):
+            raise ValueError(msg or "exit")
+
+    parser = RequestOptionParser()
+    setup_options(parser)
+    corpus_cache = CorpusCache(read_input)
+
+    def prepare(argv, cwd):
+        request_options, args = parser.parse_args(argv)
+        request_filenames = [os.path.join(cwd, filename)
+                             for filename in expand_file_arguments(args)]
+        if is_corpus_request(request_filenames, request_options, corpus_cache):
+            corpus_cache.get(request_filenames[0], request_options.input_encoding,
+                             request_options.reverse)
+
+    for filename in filenames:
+        corpus_cache.get(filename, options.input_encoding, options.reverse)
+
+    server = Server(main, corpus_cache, prepare = prepare)
+    print("percol server is listening on " + server.path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def expand_file_arguments(args):
+    """
+    Expands glob patterns in FILE arguments. Arguments which match
+    nothing are kept as they are.
+    """
+    import glob
+    filenames = []
+    for arg in args:
+        matched = sorted(glob.glob(arg)) if glob.has_magic(arg) else []
+        filenames.extend(matched or [arg])
+    return filenames
+
 def decide_match_method(options):
     if options.match_method == "regex":
         from percol.finder import FinderMultiQueryRegex
@@ -165,15 +360,65 @@ def decide_match_method(options):
         from percol.finder import FinderMultiQueryString
         return FinderMultiQueryString
 
-def main():
+FILTER_BUFFER_SIZE = 1 << 20
+FILTER_OUTPUT_BATCH_SIZE = 16384
+
+def filter_candidates(filenames, options):
+    """
+    Runs the finder over the candidates with the query given by
+    `--filter` and writes matching lines to stdout. Returns the exit
+    status (0 if any line matched, 1 otherwise).
+    """
+    import percol.actions as actions
+
+    output_encoding = set_proper_locale(options)
+    candidates, file_reader, _ = read_candidates(filenames, options,
+                                                 buffer_size=FILTER_BUFFER_SIZE)
+
+    finder = decide_match_method(options)(candidates)
+    finder.case_insensitive = not options.case_sensitive
+    finder.invert_match = options.invert_match
+
+    query = options.filter
+    if not isinstance(query, six.text_type):
+        query = query.decode(locale.getpreferredencoding())
+
+    matched_count = [0]
+    def matched_lines():
+        for line, _, idx in finder.find(query):
+            matched_count[0] += 1
+            if file_reader and options.with_filename:
+                line = file_reader.format_line_with_origin(line, idx)
+            if options.quote:
+                line = actions.double_quote_string(line)
+            yield line
+
+    try:
+        actions.write_lines(matched_lines(), output_encoding,
+                            batch_size = FILTER_OUTPUT_BATCH_SIZE)
+    except IOError as e:
+        # e.g., `percol --filter QUERY | head`
+        if e.errno != errno.EPIPE:
+            raise
+    return 0 if matched_count[0] > 0 else 1
+
+def main(argv = None, tty_fd = None, corpus_cache = None):
+    debug.mark_startup("import modules")
     from percol import __version__
-    parser = OptionParser(usage = "Usage: %prog [options] [FILE]", version = "%prog {0}".format(__version__))
+    parser = OptionParser(usage = "Usage: %prog [options] [FILE...]", version = "%prog {0}".format(__version__))
     setup_options(parser)
-    options, args = parser.parse_args()
+    options, args = parser.parse_args(argv)
+    debug.mark_startup("parse options")
 
     if options.peep:
         sys.exit(1)
 
+    if options.client:
+        from percol import client
+        exit_code = client.run([arg for arg in (argv or sys.argv[1:]) if arg != "--client"])
+        if exit_code is not None:
+            sys.exit(exit_code)
+
     def exit_program(msg = None, show_help = True):
         if not msg is None:
             print(msg)
@@ -181,17 +426,63 @@ def main():
             parser.print_help()
         sys.exit(1)
 
-    # get ttyname
+    filenames = expand_file_arguments(args)
+
+    for filename in filenames:
+        if not os.access(filename, os.R_OK):
+            exit_program(error_message("Cannot read a file '" + filename + "'"),
+                         show_help=False)
+
+    if options.source:
+        from percol.source import SOURCE_NAMES
+        if options.source.partition(":")[0] not in SOURCE_NAMES:
+            exit_program(error_message("Unknown source '{0}' (available: {1})".format(
+                options.source, ", ".join(SOURCE_NAMES))), show_help = False)
+        if filenames or options.follow:
+            exit_program(error_message("--source cannot be used with FILEs or --follow"),
+                         show_help = False)
+
+    if options.refresh is not None:
+        from percol.source import REFRESHABLE_SOURCE_NAMES
+        if not options.source or options.source.partition(":")[0] not in REFRESHABLE_SOURCE_NAMES \
+           or options.refresh <= 0 or options.reverse:
+            exit_program(error_message("--refresh requires a positive interval and --source {0} (and no --reverse)".format(
+                " / ".join(REFRESHABLE_SOURCE_NAMES))), show_help = False)
+
+    if options.follow:
+        from percol.source import guess_compression
+        if len(filenames) != 1 or options.reverse or guess_compression(filenames[0]):
+            exit_program(error_message("--follow requires exactly one uncompressed FILE (and no --reverse)"),
+                         show_help=False)
+
+    if options.server:
+        try:
+            serve(filenames, options)
+        except RuntimeError as e:
+            exit_program(error_message(str(e)), show_help = False)
+        sys.exit(0)
+
+    if options.filter is not None:
+        # non-interactive mode (no tty, no curses)
+        try:
+            sys.exit(filter_candidates(filenames, options))
+        except KeyboardInterrupt:
+            exit_program("Canceled", show_help = False)
+        except EnvironmentError as e:
+            exit_program(error_message(str(e)), show_help = False)
+
+    # get ttyname (the server is given the descriptor of the client's tty)
     ttyname = options.tty or tty.get_ttyname()
-    if not ttyname:
+    if not ttyname and tty_fd is None:
         exit_program(error_message("""No tty name is given and failed to guess it from descriptors.
 Maybe all descriptors are redirected."""))
 
     # decide which encoding to use
     output_encoding = set_proper_locale(options)
-    input_encoding = options.input_encoding
 
     def open_tty(ttyname):
+        if tty_fd is not None:
+            return os.fdopen(tty_fd, "wb+", buffering=0)
         if six.PY2:
             return open(ttyname, "r+w")
         else:
@@ -200,24 +491,24 @@ Maybe all descriptors are redirected."""))
 
     with open_tty(ttyname) as tty_f:
         if not tty_f.isatty():
-            exit_program(error_message("{0} is not a tty file".format(ttyname)),
+            exit_program(error_message("{0} is not a tty file".format(ttyname or tty_fd)),
                          show_help = False)
 
-        filename = args[0] if len(args) > 0 else None
-
-        if filename and not os.access(filename, os.R_OK):
-            exit_program(error_message("Cannot read a file '" + filename + "'"),
-                         show_help=False)
-
-        if filename is None and sys.stdin.isatty():
-            tty_f.write(INSTRUCTION_TEXT.encode(output_encoding))
+        if not filenames and not options.source and sys.stdin.isatty():
+            tty_f.write(get_instruction_text().encode(output_encoding))
             exit_program(show_help = False)
+        debug.mark_startup("open tty")
 
         # read input
         try:
-            candidates = read_input(filename, input_encoding, reverse=options.reverse)
+            candidates, file_reader, follower = read_candidates(filenames, options,
+                                                                corpus_cache=corpus_cache,
+                                                                stream_stdin=True)
         except KeyboardInterrupt:
             exit_program("Canceled", show_help = False)
+        except EnvironmentError as e:
+            exit_program(error_message(str(e)), show_help = False)
+        debug.mark_startup("open input")
 
         # setup actions
         import percol.actions as actions
@@ -248,8 +539,10 @@ Maybe all descriptors are redirected."""))
                     caret = options.caret,
                     index = options.index,
                     encoding = output_encoding) as percol:
+            debug.mark_startup("set up the screen")
             # load run-command file
             load_rc(percol, options.rcfile)
+            debug.mark_startup("load rc.py")
             # override prompts
             if options.prompt is not None:
                 percol.view.__class__.PROMPT = property(lambda self: options.prompt)
@@ -258,13 +551,25 @@ Maybe all descriptors are redirected."""))
             # evalutate strings specified by the option argument
             if options.string_to_eval is not None:
                 eval_string(percol, options.string_to_eval, locale.getpreferredencoding())
+            # styles may be changed by the rc file
+            percol.view.refresh_styles()
             # finder settings from option values
             set_finder_attribute_from_option(percol.model_candidate.finder)
             # view settings from option values
             set_if_not_none(options, percol.view, 'prompt_on_top')
             set_if_not_none(options, percol.view, 'results_top_down')
+            if options.fps is not None:
+                percol.frame_scheduler.fps = options.fps
             # command settings from options
             set_if_not_none(options, percol.command_candidate, 'select_ignore')
+            # take lines appended to the file
+            percol.candidate_feed = follower
+            # output settings from options
+            if options.with_filename and file_reader:
+                percol.format_arg_for_action = file_reader.format_line_with_origin
+            # preview pane
+            if options.preview is not None:
+                percol.set_preview(options.preview, options.preview_position)
             
             # enter main loop
             if options.auto_fail and percol.has_no_candidate:
@@ -274,4 +579,6 @@ Maybe all descriptors are redirected."""))
             else:
                 exit_code = percol.loop()
 
+        if options.startup_trace:
+            sys.stderr.write(debug.format_startup_trace())
         sys.exit(exit_code)
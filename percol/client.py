@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import signal
+import socket
+import tempfile
+
+from array import array
+
+# ============================================================ #
+# Client of `percol --server`
+# ============================================================ #
+
+# Only the standard library is used here, so the client starts fast.
+
+def get_socket_path():
+    """
+    Returns the path of the per-user socket of the server
+    ($PERCOL_SOCKET, $XDG_RUNTIME_DIR/percol.sock or
+    $TMPDIR/percol-UID/server.sock)
+    """
+    path = os.environ.get("PERCOL_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "percol.sock")
+    return os.path.join(tempfile.gettempdir(), "percol-{0}".format(os.getuid()), "server.sock")
+
+def is_private_directory(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and (st.st_mode & 0o077) == 0
+
+def send_with_fds(sock, data, fds):
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array("i", fds))])
+
+def connect(path = None):
+    """
+    Returns a socket connected to the server, or None when no server
+    is running (or passing descriptors is not supported)
+    """
+    if not hasattr(socket.socket, "sendmsg"):
+        # Python 2
+        return None
+    path = path or get_socket_path()
+    # do not hand the TTY to a socket made by someone else
+    if not is_private_directory(os.path.dirname(os.path.abspath(path))) and \
+       not os.environ.get("PERCOL_SOCKET"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+def open_tty_descriptor(argv):
+    """
+    Returns a descriptor of the TTY (given by --tty, or the one of
+    stdin / stdout / stderr, or the controlling terminal)
+    """
+    for i, arg in enumerate(argv):
+        if arg == "--tty" and i + 1 < len(argv):
+            return os.open(argv[i + 1], os.O_RDWR)
+        if arg.startswith("--tty="):
+            return os.open(arg[len("--tty="):], os.O_RDWR)
+    for fd in (0, 1, 2):
+        if os.isatty(fd):
+            return os.dup(fd)
+    return os.open("/dev/tty", os.O_RDWR)
+
+def read_line(sock_file):
+    line = sock_file.readline()
+    if not line:
+        raise EOFError("connection closed by the server")
+    return line.decode("ascii").strip()
+
+def run(argv):
+    """
+    Lets the server run percol with `argv` on our TTY and standard
+    descriptors. Returns the exit status, or None when no server is
+    available (then percol should run in this process).
+    """
+    sock = connect()
+    if sock is None:
+        return None
+    try:
+        tty_fd = open_tty_descriptor(argv)
+    except OSError:
+        sock.close()
+        return None
+
+    request = json.dumps({"argv": argv,
+                          "cwd": os.getcwd(),
+                          "env": dict(os.environ)})
+    sys.stdout.flush()
+    try:
+        send_with_fds(sock, request.encode("utf-8") + b"\n", [0, 1, 2, tty_fd])
+    finally:
+        os.close(tty_fd)
+
+    sock_file = sock.makefile("rb")
+    try:
+        pid = int(read_line(sock_file))
+    except (EOFError, ValueError):
+        sock.close()
+        return None
+
+    # the server process is not in the foreground process group of the
+    # TTY, so signals for the terminal are relayed
+    def relay(signum, frame):
+        try:
+            os.kill(pid, signal.SIGWINCH if signum == signal.SIGWINCH else signal.SIGTERM)
+        except OSError:
+            pass
+    for signum in (signal.SIGWINCH, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, relay)
+
+    try:
+        return int(read_line(sock_file))
+    except (EOFError, ValueError):
+        return 1
+    except KeyboardInterrupt:
+        relay(signal.SIGTERM, None)
+        return 1
+    finally:
+        sock.close()
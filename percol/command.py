@@ -1,6 +1,32 @@
 # -*- coding: utf-8 -*-
 import re
-import six
+
+
+class SelectIgnoreMask(object):
+    """
+    Caches whether each candidate is ignored (empty or matching the
+    select-ignore pattern) with a byte per candidate, indexed by the
+    position of the candidate in the input. Candidates are matched
+    lazily when navigation first steps over them.
+    """
+
+    UNKNOWN    = 0
+    SELECTABLE = 1
+    IGNORED    = 2
+
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern) if pattern else None
+        self.flags = bytearray()
+
+    def is_ignored(self, candidate_index, line):
+        flags = self.flags
+        if candidate_index >= len(flags):
+            flags.extend(bytearray(max(candidate_index + 1, 2 * len(flags)) - len(flags)))
+        flag = flags[candidate_index]
+        if flag == self.UNKNOWN:
+            ignored = not line or self.regex is not None and self.regex.match(line) is not None
+            flag = flags[candidate_index] = self.IGNORED if ignored else self.SELECTABLE
+        return flag == self.IGNORED
 
 
 class SelectorCommand(object):
@@ -13,32 +39,84 @@ class SelectorCommand(object):
         self.view = view
         self.select_ignore = r''
 
+    @property
+    def select_ignore(self):
+        return self.__select_ignore
+
+    @select_ignore.setter
+    def select_ignore(self, pattern):
+        self.__select_ignore = pattern
+        self.reset_ignore_mask()
+
+    def reset_ignore_mask(self):
+        # the mask is valid until candidates change in place (e.g.,
+        # replaced by --refresh)
+        self.ignore_mask = SelectIgnoreMask(self.select_ignore)
+        self.ignore_mask_version = self.model.collection_version
+        self.reset_jumps()
+
+    def get_ignore_mask(self):
+        if self.ignore_mask_version != self.model.collection_version:
+            self.reset_ignore_mask()
+        return self.ignore_mask
+
     # ------------------------------------------------------------ #
     # Selection
     # ------------------------------------------------------------ #
 
     # Line
 
+    def reset_jumps(self, snapshot = None):
+        # (result index, step) => first selectable result index from
+        # there, valid while the snapshot is current
+        self.jumps = {}
+        self.jumps_snapshot = snapshot
+
+    def is_ignored_result(self, index):
+        """
+        Returns True / False, or None when the result does not exist
+        """
+        try:
+            line, _, candidate_index = self.model.results[index]
+        except IndexError:
+            return None
+        return self.get_ignore_mask().is_ignored(candidate_index, line)
+
     def delta_next(self, step=1):
-        delta = step
+        self.get_ignore_mask()
+        if self.jumps_snapshot is not self.model.snapshot:
+            self.reset_jumps(self.model.snapshot)
+        start = index = self.model.index + step
+        if (start, step) in self.jumps:
+            return self.jumps[(start, step)] - self.model.index
+        skipped = []
         while True:
-            line = self.model.get_result(self.model.index + delta)
-            if line is None:
+            ignored = None if index < 0 else self.is_ignored_result(index)
+            if ignored is None:
                 return step
-            if not line or self.select_ignore and re.match(
-                    self.select_ignore, line):
-                delta += step
-                continue
-            break
-        return delta
+            if not ignored:
+                break
+            skipped.append(index)
+            index += step
+        # results only grow, so a run of ignored results followed by a
+        # selectable one stays as it is
+        for skipped_index in skipped:
+            self.jumps[(skipped_index, step)] = index
+        return index - self.model.index
 
     def delta_prev(self):
         return self.delta_next(step=-1)
     def select_successor(self):
-        self.model.select_index(self.model.index + 1)
+        if self.select_ignore:
+            self.model.select_index(self.model.index + self.delta_next())
+        else:
+            self.model.select_index(self.model.index + 1)
 
     def select_predecessor(self):
-        self.model.select_index(self.model.index - 1)
+        if self.select_ignore:
+            self.model.select_index(self.model.index + self.delta_prev())
+        else:
+            self.model.select_index(self.model.index - 1)
 
     def select_next(self):
         if self.view.results_top_down:
@@ -97,20 +175,17 @@ class SelectorCommand(object):
         self.toggle_mark()
         self.select_successor()
 
-    def __get_all_mark_indices(self):
-        return six.moves.range(self.model.results_count)
-
     def mark_all(self):
-        for mark_index in self.__get_all_mark_indices():
-            self.model.set_is_marked(True, mark_index)
+        self.model.set_all_marked(True)
 
     def unmark_all(self):
-        for mark_index in self.__get_all_mark_indices():
-            self.model.set_is_marked(False, mark_index)
+        self.model.set_all_marked(False)
 
     def toggle_mark_all(self):
-        for mark_index in self.__get_all_mark_indices():
-            self.model.set_is_marked(not self.model.get_is_marked(mark_index), mark_index)
+        self.model.toggle_all_marked()
+
+    def clear_marks(self):
+        self.model.clear_marks()
 
     # ------------------------------------------------------------ #
     # Caret
@@ -1,13 +1,53 @@
 # -*- coding: utf-8 -*-
 
-import syslog
-syslog.openlog("Percol")
+import time
+
+# ============================================================ #
+# Log
+# ============================================================ #
+
+syslog = None
+
+def open_syslog():
+    # opened on the first log, since most runs never log
+    global syslog
+    if syslog is None:
+        import syslog as syslog_module
+        syslog_module.openlog("Percol")
+        syslog = syslog_module
+    return syslog
 
 def log(name, s = ""):
-    syslog.syslog(syslog.LOG_ALERT, str(name) + ": " + str(s))
+    open_syslog().syslog(syslog.LOG_ALERT, str(name) + ": " + str(s))
 
 def dump(obj):
     import pprint
     pp = pprint.PrettyPrinter(indent=2)
-    syslog.syslog(syslog.LOG_ALERT, str(name) + ": " + pp.pformat(obj))
+    log("dump", pp.pformat(obj))
     return obj
+
+# ============================================================ #
+# Startup trace
+# ============================================================ #
+
+# this module is imported first among percol modules
+STARTUP_TIME = time.time()
+
+startup_marks = []
+
+def mark_startup(label):
+    startup_marks.append((label, time.time()))
+
+def format_startup_trace():
+    """
+    Returns when each startup step finished (in milliseconds since
+    percol is imported) and how long it took
+    """
+    lines = []
+    last = STARTUP_TIME
+    for label, when in startup_marks:
+        lines.append("{0:8.1f} ms {1:+8.1f} ms  {2}".format((when - STARTUP_TIME) * 1000,
+                                                           (when - last) * 1000,
+                                                           label))
+        last = when
+    return "\n".join(lines) + "\n"
@@ -58,33 +58,86 @@ def get_attributes(attrs):
 # Unicode
 # ============================================================ #
 
+# Widths of code points are looked up from compact tables, each of
+# which covers a page of 256 code points and is built on demand.
+WIDTH_PAGE_BITS = 8
+WIDTH_PAGE_MASK = (1 << WIDTH_PAGE_BITS) - 1
+TAB_WIDTH = 8
+
+width_pages = {}
+
+def get_width_page(page):
+    table = width_pages.get(page)
+    if table is None:
+        base = page << WIDTH_PAGE_BITS
+        table = bytearray(2 if unicodedata.east_asian_width(six.unichr(base + i)) in ("W", "F") else 1
+                          for i in six.moves.range(WIDTH_PAGE_MASK + 1))
+        width_pages[page] = table
+    return table
+
+def char_width(c):
+    code = ord(c)
+    return get_width_page(code >> WIDTH_PAGE_BITS)[code & WIDTH_PAGE_MASK]
+
+if hasattr(str, "isascii"):
+    def is_ascii(s):
+        return s.isascii()
+else:
+    non_ascii_pattern = re.compile(u"[^\x00-\x7f]")
+    def is_ascii(s):
+        return non_ascii_pattern.search(s) is None
+
+def screen_columns(s):
+    """
+    Returns a sequence whose i-th item is the screen column where s[i]
+    begins (the last item is the screen length of s)
+    """
+    if not isinstance(s, six.text_type) or (is_ascii(s) and "\t" not in s):
+        return six.moves.range(len(s) + 1)
+
+    columns = [0] * (len(s) + 1)
+    column = 0
+    for i, c in enumerate(s):
+        columns[i] = column
+        if c == "\t":
+            column += TAB_WIDTH - column % TAB_WIDTH
+        else:
+            code = ord(c)
+            column += get_width_page(code >> WIDTH_PAGE_BITS)[code & WIDTH_PAGE_MASK]
+    columns[len(s)] = column
+    return columns
+
 def screen_len(s, beg = None, end = None):
     if beg is None:
         beg = 0
     if end is None:
         end = len(s)
 
+    if not isinstance(s, six.text_type):
+        return end - beg
+
     if "\t" in s:
-        # consider tabstop (very naive approach)
-        beg = len(s[0:beg].expandtabs())
-        end = len(s[beg:end].expandtabs())
-        s = s.expandtabs()
+        # tab stops depend on the preceding characters
+        columns = screen_columns(s[0:end])
+        return columns[end] - columns[min(beg, end)]
 
-    if not isinstance(s, six.text_type):
+    if is_ascii(s):
         return end - beg
 
-    dis_len = end - beg
+    dis_len = 0
     for i in six.moves.range(beg, end):
-        if unicodedata.east_asian_width(s[i]) in ("W", "F"):
-            dis_len += 1
+        code = ord(s[i])
+        dis_len += get_width_page(code >> WIDTH_PAGE_BITS)[code & WIDTH_PAGE_MASK]
 
     return dis_len
 
+control_characters_pattern = re.compile(r'[\x00-\x08\x0a-\x1f]')
+
 def screen_length_to_bytes_count(string, screen_length_limit, encoding):
     bytes_count = 0
     screen_length = 0
     for unicode_char in string:
-        screen_length += screen_len(unicode_char)
+        screen_length += TAB_WIDTH if unicode_char == "\t" else char_width(unicode_char)
         char_bytes_count = len(unicode_char.encode(encoding))
         bytes_count += char_bytes_count
         if screen_length > screen_length_limit:
@@ -101,6 +154,8 @@ class Display(object):
         self.screen   = screen
         self.encoding = encoding
         self.markup_parser   = markup.MarkupParser()
+        # attributes => curses style
+        self.style_cache = {}
 
         curses.start_color()
 
@@ -124,8 +179,61 @@ class Display(object):
 
         self.update_screen_size()
 
+    # ------------------------------------------------------------ #
+    # Preview pane
+    # ------------------------------------------------------------ #
+
+    # "right" or "bottom" splits the screen and gives the part to the
+    # preview pane; WIDTH and HEIGHT then refer to the rest of it
+    preview_position = None
+    preview_ratio = 0.5
+    # (y, x, height, width) of the preview pane
+    preview_area = None
+
+    def set_preview_pane(self, position, ratio = 0.5):
+        if position not in (None, "right", "bottom"):
+            raise ValueError("Unknown preview position: " + str(position))
+        self.preview_position = position
+        self.preview_ratio = ratio
+        self.update_screen_size()
+
     def update_screen_size(self):
-        self.HEIGHT, self.WIDTH = self.screen.getmaxyx()
+        self.SCREEN_HEIGHT, self.SCREEN_WIDTH = self.screen.getmaxyx()
+        self.HEIGHT, self.WIDTH = self.SCREEN_HEIGHT, self.SCREEN_WIDTH
+        self.preview_area = None
+        if self.preview_position == "right":
+            # a column is used for the border
+            preview_width = int(self.SCREEN_WIDTH * self.preview_ratio) - 1
+            if preview_width > 0:
+                self.WIDTH = self.SCREEN_WIDTH - preview_width - 1
+                self.preview_area = (0, self.WIDTH + 1, self.SCREEN_HEIGHT, preview_width)
+        elif self.preview_position == "bottom":
+            # a line is used for the border
+            preview_height = int(self.SCREEN_HEIGHT * self.preview_ratio) - 1
+            if preview_height > 0:
+                self.HEIGHT = self.SCREEN_HEIGHT - preview_height - 1
+                self.preview_area = (self.HEIGHT + 1, 0, preview_height, self.SCREEN_WIDTH)
+
+    def draw_preview_border(self, style = None):
+        if self.preview_area is None:
+            return
+        y, x, height, width = self.preview_area
+        if self.preview_position == "right":
+            for row in six.moves.range(height):
+                self.addnstr(y + row, x - 1, u"|", 1, style)
+        else:
+            self.addnstr(y - 1, x, u"-" * width, width, style)
+
+    def add_preview_line(self, row, s, style = None):
+        """
+        Draws `s` at the `row`-th line of the preview pane (the rest of
+        the line is cleared)
+        """
+        y, x, height, width = self.preview_area
+        if len(s) > width:
+            s = s[:width]
+        s += u" " * (width - screen_len(s))
+        self.addnstr(y + row, x, s, width, style)
 
     @property
     def Y_BEGIN(self):
@@ -232,6 +340,10 @@ class Display(object):
                            y_offset = 0, x_offset = 0,
                            style = None,
                            fill = False, fill_char = " ", fill_style = None):
+        # at most WIDTH characters fit in the screen
+        if len(s) > self.WIDTH:
+            s = s[:self.WIDTH]
+
         dis_len = screen_len(s)
 
         pos_x = self.get_pos_x(x_align, x_offset, dis_len)
@@ -255,10 +367,17 @@ class Display(object):
     def attrs_to_style(self, attrs):
         if attrs is None:
             return 0
-
-        style = self.get_color_pair(get_fg_color(attrs), get_bg_color(attrs))
-        for attr in get_attributes(attrs):
-            style |= attr
+        if isinstance(attrs, six.integer_types):
+            # already resolved
+            return attrs
+
+        attrs = tuple(attrs)
+        style = self.style_cache.get(attrs)
+        if style is None:
+            style = self.get_color_pair(get_fg_color(attrs), get_bg_color(attrs))
+            for attr in get_attributes(attrs):
+                style |= attr
+            self.style_cache[attrs] = style
 
         return style
 
@@ -275,6 +394,17 @@ class Display(object):
     def clear(self):
         self.screen.clear()
 
+    def clear_line(self, y):
+        if self.WIDTH < self.SCREEN_WIDTH:
+            # keep the preview pane on the right
+            self.add_string(u" " * self.WIDTH, y, 0)
+            return
+        try:
+            self.screen.move(y, 0)
+            self.screen.clrtoeol()
+        except curses.error:
+            pass
+
     def refresh(self):
         self.screen.refresh()
 
@@ -285,11 +415,15 @@ class Display(object):
         if not isinstance(style, six.integer_types):
             style = self.attrs_to_style(style)
 
+        # at most n characters fit in n columns
+        if len(s) > n:
+            s = s[:max(n, 0)]
+
         # Compute bytes count of the substring that fits in the screen
         bytes_count_to_display = screen_length_to_bytes_count(s, n, self.encoding)
 
         try:
-            sanitized_str = re.sub(r'[\x00-\x08\x0a-\x1f]', '?', s)
+            sanitized_str = control_characters_pattern.sub('?', s)
             raw_str = self.get_raw_string(sanitized_str)
             self.screen.addnstr(y, x, raw_str, bytes_count_to_display, style)
             return True
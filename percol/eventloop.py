@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import heapq
+import select
+import threading
+
+from collections import deque
+
+try:
+    import selectors            # Python 3.4+
+except ImportError:
+    selectors = None
+
+# ============================================================ #
+# Event Loop
+# ============================================================ #
+
+class Timer(object):
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+class EventLoop(object):
+    """
+    Waits for readable file descriptors, timers and callbacks posted
+    from other threads at once, and runs their callbacks on the thread
+    calling `run_once`. Other threads (and signal handlers) wake the
+    loop up through a pipe.
+    """
+
+    def __init__(self):
+        self.readers = {}       # fd => callback
+        self.timers = []        # heap of Timer
+        self.callbacks = deque()
+        self.callbacks_lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fd in (self.wakeup_r, self.wakeup_w):
+            set_nonblocking(fd)
+        self.selector = selectors.DefaultSelector() if selectors else None
+        self.add_reader(self.wakeup_r, self.consume_wakeup)
+        self.closed = False
+
+    def close(self):
+        # threads may still post callbacks after the loop is closed, and
+        # the descriptors of the pipe may be reused by then
+        with self.callbacks_lock:
+            self.closed = True
+            self.callbacks.clear()
+        if self.selector:
+            self.selector.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+    # ------------------------------------------------------------ #
+    # Registration
+    # ------------------------------------------------------------ #
+
+    def add_reader(self, fd, callback):
+        self.readers[fd] = callback
+        if self.selector:
+            self.selector.register(fd, selectors.EVENT_READ)
+
+    def remove_reader(self, fd):
+        if self.readers.pop(fd, None) is not None and self.selector:
+            self.selector.unregister(fd)
+
+    def call_later(self, delay, callback):
+        timer = Timer(time.time() + delay, callback)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def call_soon_threadsafe(self, callback):
+        with self.callbacks_lock:
+            if self.closed:
+                return
+            self.callbacks.append(callback)
+            self.wakeup()
+
+    def wakeup(self):
+        """
+        Makes the waiting `run_once` return (safe to call from other
+        threads and signal handlers). Does nothing once closed.
+        """
+        if self.closed:
+            return
+        try:
+            os.write(self.wakeup_w, b"\0")
+        except OSError:
+            # the pipe is full, so the loop wakes up anyway
+            pass
+
+    def consume_wakeup(self):
+        try:
+            while os.read(self.wakeup_r, 4096):
+                pass
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------ #
+    # Dispatch
+    # ------------------------------------------------------------ #
+
+    def get_timeout(self, timeout):
+        while self.timers and self.timers[0].cancelled:
+            heapq.heappop(self.timers)
+        if self.callbacks:
+            return 0
+        if self.timers:
+            until_timer = max(self.timers[0].when - time.time(), 0)
+            if timeout is None or until_timer < timeout:
+                return until_timer
+        return timeout
+
+    def wait_readable(self, timeout):
+        if self.selector:
+            return [key.fd for key, events in self.selector.select(timeout)]
+        try:
+            return select.select(list(self.readers), [], [], timeout)[0]
+        except select.error:
+            # interrupted by a signal
+            return []
+
+    def run_once(self, timeout = None):
+        """
+        Waits for events at most `timeout` seconds (None to wait until
+        any event) and runs their callbacks
+        """
+        for fd in self.wait_readable(self.get_timeout(timeout)):
+            callback = self.readers.get(fd)
+            if callback is not None:
+                callback()
+
+        now = time.time()
+        while self.timers and (self.timers[0].cancelled or self.timers[0].when <= now):
+            timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback()
+
+        with self.callbacks_lock:
+            callbacks = list(self.callbacks)
+            self.callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+def set_nonblocking(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
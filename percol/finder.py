@@ -14,8 +14,10 @@ class Finder(object):
     def __init__(self, **args):
         pass
 
-    def clone_as(self, new_finder_class):
-        new_finder = new_finder_class(collection = self.collection)
+    def clone_as(self, new_finder_class, collection = None):
+        if collection is None:
+            collection = self.collection
+        new_finder = new_finder_class(collection = collection)
         new_finder.invert_match = self.invert_match
         new_finder.lazy_finding = self.lazy_finding
         return new_finder
@@ -36,6 +38,58 @@ class Finder(object):
         else:
             return [result for result in self.find(query, collection)]
 
+# ============================================================ #
+# Identity results
+# ============================================================ #
+
+class IdentityResults(object):
+    """
+    Results of a query which matches every candidate. The n-th result
+    is the n-th candidate, so index access does not run the finder
+    over the preceding candidates. Candidates appended to the
+    collection become results by themselves.
+    """
+
+    def __init__(self, collection, find_info):
+        self.collection = collection
+        self.find_info = find_info
+
+    def __len__(self):
+        return len(self.collection)
+
+    def __iter__(self):
+        find_info = self.find_info
+        for idx, line in enumerate(self.collection):
+            yield line, find_info, idx
+
+    def __getitem__(self, idx):
+        line = self.collection[idx]
+        if idx < 0:
+            idx += len(self.collection)
+        return line, self.find_info, idx
+
+    @property
+    def exhausted(self):
+        return getattr(self.collection, "exhausted", True)
+
+    def pull_until(self, count):
+        if isinstance(self.collection, LazyArray):
+            self.collection.pull_until(count)
+
+    def pull_all(self):
+        if isinstance(self.collection, LazyArray):
+            self.collection.pull_all()
+
+    def extend(self, elements):
+        pass
+
+    def has_nth_value(self, nth):
+        try:
+            self[nth]
+            return True
+        except IndexError:
+            return False
+
 # ============================================================ #
 # Cached Finder
 # ============================================================ #
@@ -53,13 +107,14 @@ class CachedFinder(Finder):
         for i in six.moves.range(len(query) - 1, 0, -1):
             query_prefix = query[0:i]
             if query_prefix in self.results_cache:
-                return (line for (line, res, idx) in self.results_cache[query_prefix])
+                return ((idx, line) for (line, res, idx) in self.results_cache[query_prefix])
         return None
 
-    def get_results(self, query):
+    def get_results(self, query, collection = None):
         if query in self.results_cache:
             return self.results_cache[query]
-        collection = self.get_collection_from_trie(query) or self.collection
+        if collection is None:
+            collection = self.get_collection_from_trie(query)
         return Finder.get_results(self, query, collection)
 
 # ============================================================ #
@@ -73,8 +128,8 @@ class FinderMultiQuery(CachedFinder):
         self.collection = collection
         self.split_str  = split_str
 
-    def clone_as(self, new_finder_class):
-        new_finder = Finder.clone_as(self, new_finder_class)
+    def clone_as(self, new_finder_class, collection = None):
+        new_finder = Finder.clone_as(self, new_finder_class, collection)
         new_finder.case_insensitive = self.case_insensitive
         new_finder.and_search = self.and_search
         return new_finder
@@ -84,7 +139,21 @@ class FinderMultiQuery(CachedFinder):
 
     dummy_res = [["", [(0, 0)]]]
 
+    def get_results(self, query, collection = None):
+        # the empty query matches every line of the collection (even
+        # with invert_match)
+        if query == "":
+            if not self.lazy_finding and isinstance(self.collection, LazyArray):
+                self.collection.pull_all()
+            return IdentityResults(self.collection, self.dummy_res)
+        return CachedFinder.get_results(self, query, collection)
+
     def find(self, query, collection = None):
+        """
+        Yields (line, find_info, index) for each matching line in
+        `collection`, an iterable of (index, line) pairs, where index
+        is the position of the line in the whole candidates
+        """
         query_is_empty = query == ""
 
         # Arrange queries
@@ -98,9 +167,9 @@ class FinderMultiQuery(CachedFinder):
             queries = [self.transform_query(query)]
 
         if collection is None:
-            collection = self.collection
+            collection = enumerate(self.collection)
 
-        for idx, line in enumerate(collection):
+        for idx, line in collection:
             if query_is_empty:
                 res = self.dummy_res
             else:
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-import curses, array
+import curses
 import six
 
 SPECIAL_KEYS = {
@@ -168,6 +168,10 @@ SPECIAL_KEYS[8] = SPECIAL_KEYS[127] = "<backspace>"
 # Other
 KEY_ESCAPE = 27
 
+# bracketed paste: the terminal sends pasted text between them
+PASTE_BEGIN = b"\x1b[200~"
+PASTE_END   = b"\x1b[201~"
+
 class KeyHandler(object):
     def __init__(self, screen):
         self.screen = screen
@@ -191,9 +195,46 @@ class KeyHandler(object):
         return k
 
     def get_utf8_key_for(self, ch):
-        buf = array.array("B", [ch])
+        buf = bytearray([ch])
         buf.extend(self.screen.getch() for i in six.moves.range(1, self.get_utf8_count(ch)))
-        return buf.tostring().decode("utf-8")
+        return buf.decode("utf-8")
+
+    def is_paste_begin(self, ch):
+        """
+        Returns True if `ch` (and the keys available after it) begins a
+        bracketed paste. Otherwise the keys read are pushed back.
+        """
+        if ch != KEY_ESCAPE:
+            return False
+        got = []
+        for expected in bytearray(PASTE_BEGIN[1:]):
+            c = self.screen.getch()
+            if c == -1:
+                break
+            got.append(c)
+            if c != expected:
+                break
+        else:
+            return True
+        for c in reversed(got):
+            curses.ungetch(c)
+        return False
+
+    def read_paste(self, ch = None):
+        """
+        Reads pasted bytes (from `ch` if given) until the end of the
+        bracketed paste, or until no key comes in the timeout of the
+        screen. Returns the bytes and whether the paste has ended.
+        """
+        buf = bytearray()
+        while not buf.endswith(PASTE_END):
+            c = self.screen.getch() if ch is None else ch
+            ch = None
+            if c == -1:
+                return bytes(buf), False
+            if c <= 0xff:
+                buf.append(c)
+        return bytes(buf[:-len(PASTE_END)]), True
 
     def is_utf8_multibyte_key(self, ch):
         return (ch & 0b11000000) == 0b11000000
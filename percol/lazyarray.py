@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import six
+import threading
+
+from itertools import islice
 
 # ============================================================ #
 # Lazy Array
@@ -11,42 +14,94 @@ class LazyArray(object):
     Wraps an iterable object and provides lazy array functionality,
     namely, lazy index access and iteration. Lazily got iteration
     results are cached and reused to provide consistent view
-    for users.
+    for users. Pulling from the iterable object is serialized by a
+    lock, so results can be drained by another thread while the
+    already got elements are read.
     """
 
-    def __init__(self, iterable_source):
-        self.source = iterable_source
-        self.got_elements = []
+    def __init__(self, iterable_source, storage = None):
+        self.source = iter(iterable_source)
+        # any list-like object (append, extend, len and indexing)
+        self.got_elements = [] if storage is None else storage
         self.read_count = 0
+        self.exhausted = False
+        self.lock = threading.RLock()
 
     def __len__(self):
         return len(self.got_elements)
 
     def __iter__(self):
-        # yield cached result
-        for elem in self.got_elements:
-            yield elem
-        # get results from iterable object
-        for elem in self.source:
-            self.read_count = self.read_count + 1
-            self.got_elements.append(elem)
-            yield elem
+        got_elements = self.got_elements
+        idx = 0
+        while True:
+            # yield cached result (including elements appended by
+            # `extend` during the iteration)
+            while idx < len(got_elements):
+                yield got_elements[idx]
+                idx += 1
+            # get a result from iterable object
+            self.pull_until(idx + 1)
+            if idx >= len(got_elements):
+                return
 
     def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            # slices with a non-negative stop are supported
+            self.pull_until(idx.stop)
+            return self.got_elements[idx]
+        # already pulled elements can be returned without touching the
+        # iterable object
+        if 0 <= idx < len(self.got_elements):
+            return self.got_elements[idx]
         # if the element corresponds to the specified index is not
         # available, pull results from iterable object
         if idx < 0:
             self.pull_all()
         else:
-            from itertools import islice
-            for elem in islice(self, 0, idx + 1):
-                pass
+            self.pull_until(idx + 1)
 
         return self.got_elements[idx]
 
+    def pull_until(self, count):
+        """
+        Pulls elements from iterable object until `count` elements
+        are available (or the iterable object is exhausted)
+        """
+        if count <= len(self.got_elements):
+            return
+        with self.lock:
+            rest = count - len(self.got_elements)
+            if rest > 0:
+                for elem in islice(self.source, rest):
+                    self.read_count = self.read_count + 1
+                    self.got_elements.append(elem)
+                if len(self.got_elements) < count:
+                    self.exhausted = True
+
     def pull_all(self):
-        for elem in self:
-            pass
+        with self.lock:
+            for elem in self.source:
+                self.read_count = self.read_count + 1
+                self.got_elements.append(elem)
+            self.exhausted = True
+
+    def extend(self, elements):
+        """
+        Appends elements after the ones of iterable object. Iterations
+        in progress also see appended elements.
+        """
+        with self.lock:
+            self.pull_all()
+            self.got_elements.extend(elements)
+
+    def replace_last(self, element):
+        """
+        Replaces the last element (after the iterable object is
+        exhausted)
+        """
+        with self.lock:
+            self.pull_all()
+            self.got_elements[-1] = element
 
     def has_nth_value(self, nth):
         try:
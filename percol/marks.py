@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import six
+
+from collections import deque
+from itertools import repeat
+
+# ============================================================ #
+# Marks
+# ============================================================ #
+
+MARKED   = 1
+UNMARKED = 0
+
+# swaps MARKED and UNMARKED (for bytearray.translate)
+INVERT_TABLE = bytes(bytearray([MARKED, UNMARKED]) + bytearray(six.moves.range(2, 256)))
+MARKED_BYTE = bytes(bytearray([MARKED]))
+
+def consume(iterator):
+    deque(iterator, maxlen = 0)
+
+class Marks(object):
+    """
+    Set of marked candidates, kept as a bytearray which has a byte for
+    each candidate (indexed by the position of the candidate in the
+    input). Marks do not depend on search results, and operations on
+    many candidates run inside the bytearray (or as C-level loops).
+    """
+
+    def __init__(self):
+        self.flags = bytearray()
+
+    def reserve(self, size):
+        if len(self.flags) < size:
+            self.flags.extend(bytearray(size - len(self.flags)))
+
+    def __contains__(self, index):
+        return index < len(self.flags) and self.flags[index] == MARKED
+
+    def __iter__(self):
+        """
+        Yields indices of marked candidates in the input order
+        """
+        flags = self.flags
+        index = flags.find(MARKED_BYTE)
+        while index >= 0:
+            yield index
+            index = flags.find(MARKED_BYTE, index + 1)
+
+    def __bool__(self):
+        return MARKED_BYTE in self.flags
+    __nonzero__ = __bool__
+
+    def set(self, index, marked):
+        self.reserve(index + 1)
+        self.flags[index] = MARKED if marked else UNMARKED
+
+    def set_range(self, start, stop, marked):
+        self.reserve(stop)
+        self.flags[start:stop] = (MARKED_BYTE if marked else b"\0") * (stop - start)
+
+    def invert_range(self, start, stop):
+        self.reserve(stop)
+        self.flags[start:stop] = self.flags[start:stop].translate(INVERT_TABLE)
+
+    def set_all(self, indices, marked, size):
+        """
+        Sets marks of candidates at `indices` (less than `size`)
+        """
+        self.reserve(size)
+        consume(six.moves.map(self.flags.__setitem__, indices,
+                              repeat(MARKED if marked else UNMARKED)))
+
+    def invert_all(self, indices, size):
+        self.reserve(size)
+        flags = self.flags
+        indices = list(indices)
+        inverted = six.moves.map(MARKED.__xor__, six.moves.map(flags.__getitem__, indices))
+        consume(six.moves.map(flags.__setitem__, indices, list(inverted)))
+
+    def clear(self):
+        del self.flags[:]
@@ -1,7 +1,31 @@
 # -*- coding: utf-8 -*-
 
 import six
+import threading
+import itertools
 from percol import display, debug
+from percol.finder import IdentityResults
+from percol.marks import Marks
+
+class ResultSnapshot(object):
+    """
+    Results of a search. A snapshot is never modified but replaced as
+    a whole, so the results, the query and the generation read from a
+    snapshot are always consistent. Lazy results only grow, and their
+    elements never change once pulled.
+    """
+
+    def __init__(self, query, generation):
+        self.results = None
+        self.query = query
+        self.generation = generation
+        # number of candidates matched against the query (None until
+        # the search reaches the end of the candidates)
+        self.candidate_count = None
+
+    @property
+    def count(self):
+        return len(self.results)
 
 class SelectorModel(object):
     def __init__(self,
@@ -10,6 +34,10 @@ class SelectorModel(object):
         self.original_finder_class = finder
         self.percol = percol
         self.finder = finder(collection)
+        self.generations = itertools.count(1)
+        # incremented when candidates change in place, so that data
+        # cached by candidate index can be dropped
+        self.collection_version = 0
         self.setup_results(query)
         self.setup_caret(caret)
         self.setup_index(index)
@@ -22,18 +50,23 @@ class SelectorModel(object):
     def absolute_index(self):
         return self.index
 
+    @property
+    def results(self):
+        return self.snapshot.results
+
     @property
     def results_count(self):
-        return len(self.results)
+        return self.snapshot.count
 
     # ============================================================ #
     # Initializer
     # ============================================================ #
 
     def setup_results(self, query):
-        self.query   = self.old_query = query or u""
-        self.results = self.finder.get_results(self.query)
-        self.marks   = {}
+        self.query    = self.old_query = query or u""
+        self.snapshot = self.build_snapshot(self.query, prefetch_count = 0)
+        # marks are kept by candidate, so they survive searches
+        self.marks    = Marks()
 
     def setup_caret(self, caret):
         if isinstance(caret, six.string_types):
@@ -47,6 +80,7 @@ class SelectorModel(object):
 
     def setup_index(self, index):
         self.index = 0
+        self.seeker = None
         if index is None or index == "first":
             self.select_top()
         elif index == "last":
@@ -67,13 +101,160 @@ class SelectorModel(object):
 
     old_query = u""
     def do_search(self, query):
-        with self.percol.global_lock:
-            self.index = 0
-            self.results = self.finder.get_results(query)
-            self.marks   = {}
-            # search finished
-            self.search_forced = False
-            self.old_query = query
+        self.apply_snapshot(self.build_snapshot(query))
+
+    # number of results found by build_snapshot() for lazy results, so
+    # that the first page is ready before the snapshot is shown
+    SEARCH_PREFETCH_COUNT = 128
+
+    def build_snapshot(self, query, prefetch_count = None):
+        """
+        Searches `query` and returns the results as a snapshot without
+        installing it. Can be called from any thread.
+        """
+        snapshot = ResultSnapshot(query, next(self.generations))
+        results = snapshot.results = self.finder.get_results(query, self.scan_candidates(snapshot))
+        if prefetch_count is None:
+            prefetch_count = self.SEARCH_PREFETCH_COUNT
+        if prefetch_count > 0 and hasattr(results, "pull_until"):
+            results.pull_until(prefetch_count)
+        return snapshot
+
+    # candidates are scanned chunk by chunk
+    SCAN_CHUNK_SIZE = 256
+
+    def scan_candidates(self, snapshot):
+        """
+        Returns an iterator of (index, candidate) pairs for the search
+        of `snapshot`, which records how many candidates are scanned in
+        the end
+        """
+        return itertools.chain.from_iterable(self.iter_candidate_chunks(snapshot))
+
+    def iter_candidate_chunks(self, snapshot):
+        collection = self.finder.collection
+        start = 0
+        while True:
+            chunk = collection[start:start + self.SCAN_CHUNK_SIZE]
+            if not chunk:
+                break
+            yield enumerate(chunk, start)
+            start += len(chunk)
+        snapshot.candidate_count = start
+        # candidates may be appended after the last one is scanned
+        self.percol.call_in_main_thread(self.append_candidates)
+
+    def apply_snapshot(self, snapshot):
+        """
+        Installs `snapshot` (in the main thread) unless a newer one is
+        already installed
+        """
+        if snapshot.generation < self.snapshot.generation:
+            return False
+        self.cancel_seek()
+        self.snapshot = snapshot
+        self.index = 0
+        # search finished
+        self.search_forced = False
+        self.old_query = snapshot.query
+        # match candidates appended during the search
+        self.append_candidates()
+        return True
+
+    def append_candidates(self):
+        """
+        Matches candidates appended to the collection after the search
+        of the current snapshot scanned all candidates, and appends them
+        to the results. Searches which have not reached the end of the
+        candidates yet reach the new candidates by themselves.
+        """
+        snapshot = self.snapshot
+        start = snapshot.candidate_count
+        collection = self.finder.collection
+        if start is None or start >= len(collection):
+            return
+        end = len(collection)
+        new_candidates = ((idx, collection[idx])
+                          for idx in six.moves.range(start, end))
+        snapshot.results.extend(list(self.finder.find(snapshot.query, new_candidates)))
+        snapshot.candidate_count = end
+
+    def update_last_candidate(self):
+        """
+        Matches the last candidate again after it is replaced in the
+        collection. Searches which have not reached the end of the
+        candidates see the new one by themselves.
+        """
+        snapshot = self.snapshot
+        last = len(self.finder.collection) - 1
+        if snapshot.candidate_count is None or snapshot.candidate_count <= last:
+            return
+        results = snapshot.results
+        if not isinstance(results, IdentityResults):
+            results = getattr(results, "got_elements", results)
+            if results and results[-1][2] == last:
+                results.pop()
+        snapshot.candidate_count = last
+        self.collection_version += 1
+        self.append_candidates()
+        if self.index >= self.results_count:
+            self.index = max(self.results_count - 1, 0)
+
+    def replace_collection(self, collection, get_key = None):
+        """
+        Replaces the candidates with `collection` (a list) and installs
+        the results of the current query at once. Lines also found in
+        the old candidates reuse their old match results, so only new
+        (or changed) lines are matched. When `get_key` (line => key) is
+        given, the selection and marks follow lines with the same key.
+        """
+        old_collection = self.finder.collection
+        old_results = self.results
+        if hasattr(old_results, "pull_all"):
+            old_results.pull_all()
+        selected_key = None
+        if get_key:
+            selected = self.get_selected_result()
+            selected_key = None if selected is None else get_key(selected)
+            marked_keys = set(get_key(old_collection[index]) for index in self.marks)
+
+        # the query typed last (its search may be in progress, and its
+        # snapshot is rejected once this newer one is installed)
+        query = self.query
+        self.finder = self.finder.clone_as(self.finder.__class__, collection)
+        snapshot = ResultSnapshot(query, next(self.generations))
+        if query:
+            if query == self.snapshot.query and not self.search_forced:
+                old_lines = set(old_collection[:len(old_collection)])
+                old_matches = dict((line, find_info) for line, find_info, _ in old_results)
+            else:
+                # old results are of another query (or finder settings)
+                old_lines = old_matches = {}
+            new_lines = [(idx, line) for idx, line in enumerate(collection)
+                         if line not in old_lines]
+            new_matches = dict((result[2], result) for result in self.finder.find(query, new_lines))
+            results = []
+            for idx, line in enumerate(collection):
+                if idx in new_matches:
+                    results.append(new_matches[idx])
+                elif line in old_matches:
+                    results.append((line, old_matches[line], idx))
+            snapshot.results = results
+        else:
+            snapshot.results = self.finder.get_results(query)
+        snapshot.candidate_count = len(collection)
+        self.collection_version += 1
+
+        self.marks.clear()
+        self.apply_snapshot(snapshot)
+        if get_key:
+            for idx, line in enumerate(collection):
+                if get_key(line) in marked_keys:
+                    self.marks.set(idx, True)
+            for index, result in enumerate(snapshot.results):
+                if get_key(result[0]) == selected_key:
+                    self.set_index(index)
+                    break
 
     def get_result(self, index):
         try:
@@ -85,21 +266,34 @@ class SelectorModel(object):
         return self.get_result(self.index)
 
     def get_selected_results_with_index(self):
-        results = self.get_marked_results_with_index()
-        if not results:
+        return list(self.iter_selected_results_with_index())
+
+    def iter_selected_results_with_index(self):
+        """
+        Yields marked results, or the current result when nothing is
+        marked, without building an intermediate list
+        """
+        has_marked = False
+        for result in self.iter_marked_results_with_index():
+            has_marked = True
+            yield result
+        if not has_marked:
             try:
                 index = self.index
                 result = self.results[index] # EAFP (results may be a zero-length list)
-                results.append((result[0], index, result[2]))
+                yield (result[0], index, result[2])
             except Exception as e:
                 debug.log("get_selected_results_with_index", e)
-        return results
 
     # ------------------------------------------------------------ #
     #  Selections
     # ------------------------------------------------------------ #
 
     def select_index(self, idx):
+        self.cancel_seek()
+        self.set_index(idx)
+
+    def set_index(self, idx):
         try:
             # For lazy results, correct "results_count" by getting
             # items (if available)
@@ -114,28 +308,123 @@ class SelectorModel(object):
         self.select_index(0)
 
     def select_bottom(self):
-        self.select_index(-1)
+        self.seek_index(-1)
+
+    # ------------------------------------------------------------ #
+    # Seek
+    # ------------------------------------------------------------ #
+
+    # number of results pulled at once while seeking
+    SEEK_BATCH_SIZE = 4096
+
+    @property
+    def seeking(self):
+        return self.seeker is not None
+
+    def seek_index(self, idx):
+        """
+        Selects `idx` after lazy results are pulled up to it in a
+        background thread, so that keys are still handled meanwhile.
+        Any other selection or a new search cancels the seek.
+        """
+        self.cancel_seek()
+        results = self.results
+        if getattr(results, "exhausted", True) or 0 <= idx < len(results):
+            self.set_index(idx)
+            return
+
+        cancelled = threading.Event()
+        count = idx + 1 if idx >= 0 else None
+
+        def drain():
+            try:
+                while not cancelled.is_set() and not results.exhausted:
+                    if count is not None and len(results) >= count:
+                        break
+                    results.pull_until(len(results) + self.SEEK_BATCH_SIZE)
+                    # show the progress
+                    self.percol.request_redraw()
+            except Exception as e:
+                debug.log("seek_index", e)
+            self.percol.call_in_main_thread(finish)
+
+        def finish():
+            if not cancelled.is_set():
+                self.seeker = None
+                self.set_index(idx)
+
+        self.seeker = cancelled
+        thread = threading.Thread(target = drain)
+        thread.daemon = True
+        thread.start()
+
+    def cancel_seek(self):
+        if self.seeker is not None:
+            self.seeker.set()
+            self.seeker = None
 
     # ------------------------------------------------------------ #
     # Mark
     # ------------------------------------------------------------ #
 
     def get_marked_results_with_index(self):
-        if self.marks:
-            return [(self.results[index][0], index, self.results[index][2])
-                    for index in self.marks if self.get_is_marked(index)]
-        else:
-            return []
+        return list(self.iter_marked_results_with_index())
+
+    def iter_marked_results_with_index(self):
+        """
+        Yields marked candidates in the input order, including ones not
+        matching the current query (their result index is None)
+        """
+        collection = self.finder.collection
+        for candidate_index in self.marks:
+            yield (collection[candidate_index], None, candidate_index)
+
+    def get_candidate_index(self, index):
+        try:
+            return self.results[index][2]
+        except IndexError:
+            return None
 
     def set_is_marked(self, marked, index = None):
         if index is None:
             index = self.index          # use current index
-        self.marks[index] = marked
+        candidate_index = self.get_candidate_index(index)
+        if candidate_index is not None:
+            self.marks.set(candidate_index, marked)
 
     def get_is_marked(self, index = None):
         if index is None:
             index = self.index          # use current index
-        return self.marks.get(index, False)
+        candidate_index = self.get_candidate_index(index)
+        return candidate_index is not None and candidate_index in self.marks
+
+    def iter_result_candidate_indices(self):
+        # results pulled so far
+        results = self.results
+        return six.moves.map(lambda result: result[2], results[:len(results)])
+
+    def set_all_marked(self, marked):
+        """
+        Marks (or unmarks) all results pulled so far
+        """
+        results = self.results
+        size = len(self.finder.collection)
+        if isinstance(results, IdentityResults):
+            # results are candidates themselves
+            self.marks.set_range(0, len(results), marked)
+        else:
+            self.marks.set_all(self.iter_result_candidate_indices(), marked, size)
+
+    def toggle_all_marked(self):
+        results = self.results
+        size = len(self.finder.collection)
+        if isinstance(results, IdentityResults):
+            self.marks.invert_range(0, len(results))
+        else:
+            self.marks.invert_all(self.iter_result_candidate_indices(), size)
+
+    def clear_marks(self):
+        self.marks.clear()
 
     # ------------------------------------------------------------ #
     # Caret position
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import signal
+import subprocess
+import threading
+import six
+
+from collections import OrderedDict
+
+from percol import debug
+
+# ============================================================ #
+# Preview
+# ============================================================ #
+
+ansi_escape_pattern = re.compile(u"\x1b\\[[0-9;?]*[A-Za-z]")
+
+def quote_shell_argument(s):
+    return u"'" + s.replace(u"'", u"'\\''") + u"'"
+
+def kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+class Previewer(object):
+    """
+    Generates previews of candidates in a worker thread. `command` is
+    either a callable which receives a candidate and returns its
+    preview, or a shell command where `{}` is replaced with the quoted
+    candidate (the candidate is appended when `{}` is missing).
+
+    Only the latest requested candidate is generated: requesting
+    another candidate cancels the running command. Generated previews
+    are kept in a size-bounded LRU cache keyed by candidate.
+    """
+
+    cache_size = 64
+    # previews are truncated to this size (in bytes or characters)
+    max_length = 1 << 16
+
+    def __init__(self, command, encoding = "utf-8", on_update = None):
+        self.command = command
+        self.encoding = encoding
+        self.on_update = on_update
+        self.cache = OrderedDict()
+        self.condition = threading.Condition()
+        self.pending = None     # candidate waiting for the worker
+        self.running = None     # candidate being generated
+        self.process = None
+        self.cancelled = False
+        self.worker = None
+
+    # ------------------------------------------------------------ #
+    # Interface
+    # ------------------------------------------------------------ #
+
+    def get(self, candidate):
+        """
+        Returns the preview of `candidate` as a list of lines, or None
+        when it is not generated yet (then it is requested)
+        """
+        with self.condition:
+            lines = self.cache.get(candidate)
+            if lines is not None:
+                # mark as recently used
+                del self.cache[candidate]
+                self.cache[candidate] = lines
+                return lines
+            self.request(candidate)
+            return None
+
+    def request(self, candidate):
+        with self.condition:
+            if candidate == self.running or candidate == self.pending:
+                return
+            self.cancel()
+            self.pending = candidate
+            if self.worker is None:
+                self.worker = threading.Thread(target = self.work)
+                self.worker.daemon = True
+                self.worker.start()
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.pending = None
+            self.cancelled = self.running is not None
+            if self.process is not None:
+                kill_process_group(self.process)
+
+    @property
+    def busy(self):
+        return self.pending is not None or self.running is not None
+
+    # ------------------------------------------------------------ #
+    # Worker
+    # ------------------------------------------------------------ #
+
+    def work(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                candidate = self.running = self.pending
+                self.pending = None
+                self.cancelled = False
+            try:
+                lines = self.generate(candidate)
+            except Exception as e:
+                debug.log("Previewer", e)
+                lines = [six.text_type(e)]
+            with self.condition:
+                self.running = None
+                self.process = None
+                if lines is not None:
+                    self.cache[candidate] = lines
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last = False)
+            if lines is not None and self.on_update:
+                self.on_update()
+
+    def generate(self, candidate):
+        """
+        Returns the preview of `candidate` as a list of lines, or None
+        when the generation is cancelled
+        """
+        if callable(self.command):
+            text = self.command(candidate) or u""
+            if not isinstance(text, six.text_type):
+                text = text.decode(self.encoding, "replace")
+            text = text[:self.max_length]
+        else:
+            text = self.run_shell_command(candidate)
+            if text is None:
+                return None
+        return ansi_escape_pattern.sub(u"", text).expandtabs().splitlines()
+
+    def run_shell_command(self, candidate):
+        quoted = quote_shell_argument(candidate)
+        if u"{}" in self.command:
+            command = self.command.replace(u"{}", quoted)
+        else:
+            command = self.command + u" " + quoted
+        with self.condition:
+            if self.cancelled:
+                return None
+            with open(os.devnull, "rb") as devnull:
+                process = self.process = subprocess.Popen(command.encode(self.encoding) if six.PY2 else command,
+                                                          shell = True,
+                                                          stdin = devnull,
+                                                          stdout = subprocess.PIPE,
+                                                          stderr = subprocess.STDOUT,
+                                                          # to kill commands spawned by the shell as well
+                                                          preexec_fn = os.setsid)
+        output = process.stdout.read(self.max_length)
+        process.stdout.close()
+        if process.poll() is None:
+            # output is truncated
+            kill_process_group(process)
+        process.wait()
+        if self.cancelled:
+            return None
+        return output.decode(self.encoding, "replace")
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import threading
+
+from percol import debug
+
+# ============================================================ #
+# Process list
+# ============================================================ #
+
+PROC_DIR = "/proc"
+
+# arguments may contain newlines and such
+control_characters_pattern = re.compile(b"[\x00-\x1f\x7f]+")
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def get_boot_time():
+    for line in read_file(os.path.join(PROC_DIR, "stat")).splitlines():
+        if line.startswith(b"btime "):
+            return int(line.split()[1])
+    return 0
+
+def get_pid_width():
+    try:
+        return len(read_file(os.path.join(PROC_DIR, "sys/kernel/pid_max")).strip())
+    except (IOError, OSError):
+        return 7
+
+user_names = {}                 # uid => name
+
+def get_user_name(uid):
+    name = user_names.get(uid)
+    if name is None:
+        try:
+            import pwd
+            name = pwd.getpwuid(uid).pw_name
+        except (ImportError, KeyError):
+            name = str(uid)
+        user_names[uid] = name
+    return name
+
+def format_start_time(start, now):
+    # like ps: the time for today's processes, the date otherwise
+    if now - start < 24 * 60 * 60:
+        return time.strftime("%H:%M", time.localtime(start))
+    return time.strftime("%b%d", time.localtime(start))
+
+class ProcessList(object):
+    """
+    Lists processes read from /proc as column-aligned lines like
+    `ps aux` (USER PID PPID STAT START COMMAND), sorted by PID. With
+    `refresh_interval`, a background thread re-reads /proc
+    periodically and keeps the latest lines for `get_replacement`.
+
+    Only the stat file is read again for processes already seen, and
+    lines of processes which did not change are kept as they are, so
+    that their match results can be reused.
+    """
+
+    user_width = 8
+
+    def __init__(self, encoding = "utf-8", refresh_interval = None):
+        self.encoding = encoding
+        self.refresh_interval = refresh_interval
+        self.boot_time = get_boot_time()
+        self.ticks_per_second = os.sysconf("SC_CLK_TCK")
+        self.pid_width = get_pid_width()
+        # (pid, start ticks) => (user, command); a pid may be reused
+        self.process_info = {}
+        self.lines = None
+        self.replacement = None
+        self.lock = threading.Lock()
+        self.watcher = None
+        # called (from the watcher thread) when the list changes
+        self.on_update = None
+
+    # ------------------------------------------------------------ #
+    # Reading /proc
+    # ------------------------------------------------------------ #
+
+    def read_process(self, pid, now):
+        proc_path = os.path.join(PROC_DIR, pid)
+        stat = read_file(os.path.join(proc_path, "stat"))
+        # the command name in parentheses may contain spaces
+        comm_end = stat.rfind(b")")
+        comm = stat[stat.find(b"(") + 1:comm_end]
+        fields = stat[comm_end + 2:].split()
+        state, ppid, start_ticks = fields[0], fields[1], int(fields[19])
+
+        key = (pid, start_ticks)
+        info = self.process_info.get(key)
+        if info is None:
+            user = get_user_name(os.stat(proc_path).st_uid)
+            command = read_file(os.path.join(proc_path, "cmdline")).rstrip(b"\0")
+            command = control_characters_pattern.sub(b" ", command)
+            if not command:
+                # kernel threads
+                command = b"[" + comm + b"]"
+            info = self.process_info[key] = (user, command.decode(self.encoding, "replace"))
+        user, command = info
+
+        if len(user) > self.user_width:
+            user = user[:self.user_width - 1] + u"+"
+        start = self.boot_time + start_ticks // self.ticks_per_second
+        return u"{0:<{1}} {2:>{3}} {4:>{3}} {5:<4} {6:>5} {7}".format(
+            user, self.user_width,
+            pid, self.pid_width,
+            ppid.decode("ascii"),
+            state.decode("ascii"),
+            format_start_time(start, now),
+            command), key
+
+    def read_lines(self):
+        now = time.time()
+        lines = []
+        alive = set()
+        pids = sorted((name for name in os.listdir(PROC_DIR) if name.isdigit()), key = int)
+        for pid in pids:
+            try:
+                line, key = self.read_process(pid, now)
+            except (IOError, OSError, IndexError, ValueError):
+                # exited while reading
+                continue
+            lines.append(line)
+            alive.add(key)
+        # forget exited processes
+        for key in set(self.process_info) - alive:
+            del self.process_info[key]
+        return lines
+
+    # ------------------------------------------------------------ #
+    # Candidates
+    # ------------------------------------------------------------ #
+
+    def iter_lines(self):
+        if not os.path.isdir(os.path.join(PROC_DIR, "self")):
+            raise IOError("Listing processes requires " + PROC_DIR)
+        self.lines = self.read_lines()
+        if self.refresh_interval:
+            self.start_watching()
+        return iter(self.lines)
+
+    @staticmethod
+    def get_line_key(line):
+        """
+        Returns the PID of `line`, which identifies the line across
+        refreshes (used to keep the selection and marks)
+        """
+        fields = line.split(None, 2)
+        return fields[1] if len(fields) > 1 else None
+
+    def start_watching(self):
+        if self.watcher is None:
+            self.watcher = threading.Thread(target = self.watch)
+            self.watcher.daemon = True
+            self.watcher.start()
+
+    def watch(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                lines = self.read_lines()
+            except Exception as e:
+                debug.log("ProcessList", e)
+                continue
+            if lines == self.lines:
+                continue
+            self.lines = lines
+            with self.lock:
+                self.replacement = lines
+            if self.on_update:
+                self.on_update()
+
+    def get_replacement(self):
+        """
+        Returns the latest lines when they changed since the last call
+        (None otherwise)
+        """
+        with self.lock:
+            replacement, self.replacement = self.replacement, None
+        return replacement
+
+    def get_new_lines(self):
+        # lines are replaced as a whole instead
+        return []
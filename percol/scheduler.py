@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from percol import debug
+
+# ============================================================ #
+# Frame Scheduler
+# ============================================================ #
+
+class FrameScheduler(object):
+    """
+    Coalesces redraw requests. `request` only marks the screen dirty
+    (and may be called from any thread); the main loop asks how long
+    it may wait and calls `draw_if_due`, which draws at most `fps`
+    times per second.
+    """
+
+    def __init__(self, draw, fps = 60):
+        self.draw = draw
+        self.fps = fps
+        self.dirty = False
+        self.last_frame_time = 0
+        # statistics
+        self.request_count = 0
+        self.frame_count = 0
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.fps if self.fps > 0 else 0
+
+    def request(self):
+        self.request_count += 1
+        self.dirty = True
+
+    def time_until_next_frame(self):
+        """
+        Returns seconds until the pending frame can be drawn (0 if it
+        is due now), or None if no frame is pending
+        """
+        if not self.dirty:
+            return None
+        return max(self.last_frame_time + self.frame_interval - time.time(), 0)
+
+    def draw_if_due(self):
+        if self.time_until_next_frame() == 0:
+            self.draw_now()
+            return True
+        return False
+
+    def draw_now(self):
+        self.dirty = False
+        self.last_frame_time = time.time()
+        self.frame_count += 1
+        self.draw()
+
+# ============================================================ #
+# Search Worker
+# ============================================================ #
+
+class SearchWorker(object):
+    """
+    Runs searches in a long-lived thread. Requests are kept in a
+    single slot, so only the newest one is pending and older ones are
+    superseded. A search starts once no request has arrived for a
+    while (debounce). Searches build result snapshots of models, which
+    are passed to `on_finish(model, snapshot)` (in the worker thread)
+    to be installed.
+
+    The debounce delay adapts to the cost of searches: a moving
+    average of search time is kept per finder and per collection size
+    (in powers of two), and the delay is proportional to it within
+    [min_delay, max_delay]. `delay` is used until a search of the kind
+    is measured, or always when `adaptive` is False.
+    """
+
+    adaptive = True
+    min_delay = 0.0
+    max_delay = 0.3
+    # delay / average search time
+    cost_ratio = 1.0
+    # weight of a new measurement in the moving average
+    cost_smoothing = 0.3
+
+    def __init__(self, on_finish = None, delay = 0.05):
+        self.on_finish = on_finish
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.pending = None     # model waiting for a search
+        self.pending_query = None
+        self.pending_delay = delay
+        self.searching = None   # (model, query) being searched
+        self.last_request_time = 0
+        self.worker = None
+        # (finder name, size bucket) => average search time
+        self.search_costs = {}
+        # statistics
+        self.request_count = 0
+        self.search_count = 0
+        self.superseded_count = 0
+
+    @property
+    def busy(self):
+        return self.pending is not None or self.searching is not None
+
+    @property
+    def stats(self):
+        return {
+            "requests": self.request_count,
+            "searches": self.search_count,
+            "superseded": self.superseded_count,
+            "delay": self.pending_delay,
+            "costs": dict(self.search_costs),
+        }
+
+    # ------------------------------------------------------------ #
+    # Search cost
+    # ------------------------------------------------------------ #
+
+    def get_cost_key(self, model):
+        finder = model.finder
+        return finder.get_name(), len(finder.collection).bit_length()
+
+    def get_delay(self, model):
+        if not self.adaptive:
+            return self.delay
+        cost = self.search_costs.get(self.get_cost_key(model))
+        if cost is None:
+            return self.delay
+        return min(max(cost * self.cost_ratio, self.min_delay), self.max_delay)
+
+    def record_cost(self, key, cost):
+        average = self.search_costs.get(key)
+        if average is not None:
+            cost = average + (cost - average) * self.cost_smoothing
+        self.search_costs[key] = cost
+
+    def request(self, model):
+        """
+        Asks to search again with the query of `model`
+        """
+        with self.condition:
+            if self.pending is model and self.pending_query == model.query:
+                return
+            # a forced search (e.g., the finder is changed) must not be
+            # answered by the search in progress
+            if self.pending is None and self.searching == (model, model.query) and \
+               not model.search_forced:
+                return
+            self.request_count += 1
+            if self.pending is not None:
+                self.superseded_count += 1
+            self.pending = model
+            self.pending_query = model.query
+            self.pending_delay = self.get_delay(model)
+            self.last_request_time = time.time()
+            if self.worker is None:
+                self.worker = threading.Thread(target = self.work)
+                self.worker.daemon = True
+                self.worker.start()
+            self.condition.notify()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                # wait until requests settle down
+                while True:
+                    rest = self.last_request_time + self.pending_delay - time.time()
+                    if rest <= 0:
+                        break
+                    self.condition.wait(rest)
+                model = self.pending
+                query = model.query
+                self.pending = None
+                self.searching = (model, query)
+            snapshot = None
+            try:
+                cost_key = self.get_cost_key(model)
+                start_time = time.time()
+                snapshot = model.build_snapshot(query)
+                self.record_cost(cost_key, time.time() - start_time)
+            except Exception as e:
+                debug.log("SearchWorker", e)
+            finally:
+                self.search_count += 1
+                self.searching = None
+            if snapshot is not None and self.on_finish:
+                self.on_finish(model, snapshot)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import struct
+import traceback
+
+from array import array
+
+from percol import debug
+from percol.client import get_socket_path, is_private_directory
+
+# ============================================================ #
+# Corpora
+# ============================================================ #
+
+class CorpusCache(object):
+    """
+    Keeps lines of files read by earlier requests. A corpus is reused
+    as long as the file keeps its size and modification time.
+    """
+
+    def __init__(self, read_lines):
+        self.read_lines = read_lines
+        self.corpora = {}       # (path, encoding, reverse) => (stamp, lines)
+
+    def get_stamp(self, path):
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime)
+
+    def can_cache(self, path):
+        # pipes (e.g., <(command)) are not cached
+        return os.path.isfile(path)
+
+    def get(self, path, encoding, reverse = False):
+        """
+        Returns lines of `path`, reading the file only when it is new or
+        modified
+        """
+        path = os.path.realpath(path)
+        key = (path, encoding, reverse)
+        stamp = self.get_stamp(path)
+        cached = self.corpora.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        lines = list(self.read_lines(path, encoding, reverse))
+        self.corpora[key] = (stamp, lines)
+        return lines
+
+# ============================================================ #
+# Server
+# ============================================================ #
+
+REQUEST_MAX_FD_COUNT = 4
+
+def create_server_socket(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    if not is_private_directory(directory) and not os.environ.get("PERCOL_SOCKET"):
+        raise RuntimeError("{0} must be a directory only you can access".format(directory))
+    if os.path.exists(path):
+        # remove the socket left by a server which is not running
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.unlink(path)
+        else:
+            raise RuntimeError("percol server is already running on " + path)
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    sock.listen(16)
+    return sock
+
+def get_peer_uid(conn):
+    SO_PEERCRED = getattr(socket, "SO_PEERCRED", None)
+    if SO_PEERCRED is None:
+        return os.getuid()      # the socket is private anyway
+    pid, uid, gid = struct.unpack("3i", conn.getsockopt(socket.SOL_SOCKET, SO_PEERCRED,
+                                                         struct.calcsize("3i")))
+    return uid
+
+def receive_request(conn):
+    """
+    Returns (request, fds) sent by `client.run`
+    """
+    fds = array("i")
+    data, ancdata, flags, addr = conn.recvmsg(1 << 16, socket.CMSG_SPACE(REQUEST_MAX_FD_COUNT * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    while data and not data.endswith(b"\n"):
+        chunk = conn.recv(1 << 16)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data.decode("utf-8")), list(fds)
+
+def detach_from_terminal(tty_fd):
+    """
+    Starts a new session, and makes `tty_fd` its controlling terminal
+    when the terminal has no session yet (a terminal can belong to one
+    session only, e.g., the one of the client's shell)
+    """
+    import fcntl, termios
+    os.setsid()
+    try:
+        fcntl.ioctl(tty_fd, termios.TIOCSCTTY, 0)
+    except (IOError, OSError):
+        pass
+    # without a controlling terminal, job control signals are never
+    # sent, but be sure in case the terminal became the controlling one
+    for signum in (signal.SIGTTOU, signal.SIGTTIN):
+        signal.signal(signum, signal.SIG_IGN)
+
+def close_fds(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+class Server(object):
+    """
+    Runs percol for clients (`percol --client`) on their TTYs. Modules
+    and corpora are loaded once in the server process, and each request
+    is served in a forked process which inherits them. The run-command
+    file is loaded by each forked process (from its cached code).
+    """
+
+    def __init__(self, run_percol, corpus_cache, prepare = None, path = None):
+        # run_percol(argv, tty_fd, corpus_cache) runs percol in a child
+        self.run_percol = run_percol
+        # prepare(argv, cwd) loads corpora for a request in the server (so
+        # they stay warm for later requests)
+        self.prepare = prepare
+        self.corpus_cache = corpus_cache
+        self.path = path or get_socket_path()
+        self.sock = None
+
+    def serve_forever(self):
+        self.sock = create_server_socket(self.path)
+        # children are reaped automatically
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        # remove the socket when killed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.error as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.handle_connection(conn)
+                except Exception as e:
+                    debug.log("Server", e)
+                finally:
+                    conn.close()
+        finally:
+            self.sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def handle_connection(self, conn):
+        fds = []
+        try:
+            request, fds = receive_request(conn)
+            if get_peer_uid(conn) != os.getuid() or len(fds) != REQUEST_MAX_FD_COUNT:
+                return
+            if self.prepare:
+                try:
+                    self.prepare(request["argv"], request["cwd"])
+                except (Exception, SystemExit) as e:
+                    # bad requests are reported by the child instead
+                    debug.log("Server.prepare", e)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    status = self.run_request(conn, request, fds)
+                except BaseException:
+                    traceback.print_exc()
+                    status = 1
+                try:
+                    conn.sendall("{0}\n".format(status).encode("ascii"))
+                finally:
+                    os._exit(status)
+        finally:
+            close_fds(fds)
+
+    def run_request(self, conn, request, fds):
+        stdin_fd, stdout_fd, stderr_fd, tty_fd = fds
+        # leave the session (and the process group) of the server before
+        # touching the tty, since the server may be a background job of
+        # the terminal (`percol --server &`), whose processes are stopped
+        # by SIGTTOU / SIGTTIN on the tty
+        detach_from_terminal(tty_fd)
+        self.sock.close()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for fd, std_fd in zip((stdin_fd, stdout_fd, stderr_fd), (0, 1, 2)):
+            os.dup2(fd, std_fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        conn.sendall("{0}\n".format(os.getpid()).encode("ascii"))
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+        try:
+            self.run_percol(request["argv"], tty_fd = os.dup(tty_fd),
+                            corpus_cache = self.corpus_cache)
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        sys.stdout.flush()
+        return status
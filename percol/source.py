@@ -0,0 +1,634 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import codecs
+import errno
+import select
+import threading
+import six
+
+from bisect import bisect_right
+from itertools import islice
+from six.moves import queue
+
+from percol import debug
+
+# ============================================================ #
+# Block reader
+# ============================================================ #
+
+READ_BLOCK_SIZE = 1 << 20
+PREFETCH_BLOCK_COUNT = 8
+
+def iter_blocks_in_background(stream,
+                              block_size = READ_BLOCK_SIZE,
+                              prefetch_count = PREFETCH_BLOCK_COUNT):
+    """
+    Reads `stream` block by block in a background thread and yields
+    the blocks. At most `prefetch_count` blocks are read ahead, so
+    reading (and decompressing) overlaps with the consumer.
+    """
+    blocks = queue.Queue(prefetch_count)
+
+    def read_blocks():
+        try:
+            while True:
+                block = stream.read(block_size)
+                blocks.put(block)
+                if not block:
+                    break
+        except Exception as e:
+            blocks.put(e)
+
+    reader = threading.Thread(target = read_blocks)
+    reader.daemon = True
+    reader.start()
+
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        if not block:
+            break
+        yield block
+
+def iter_lines_from_blocks(blocks, encoding, errors = "replace"):
+    """
+    Decodes byte blocks and splits them into lines (without newlines)
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    rest = u""
+    for block in blocks:
+        lines = (rest + decoder.decode(block)).split(u"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line
+    rest += decoder.decode(b"", True)
+    if rest:
+        yield rest
+
+# ============================================================ #
+# Compressed files
+# ============================================================ #
+
+COMPRESSION_MAGICS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "lzma"),
+)
+
+def guess_compression(filename):
+    """
+    Returns the name of the module which decompresses `filename`
+    judging from its magic bytes, or None for uncompressed files
+    """
+    # do not consume data from pipes (e.g., <(command))
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "rb") as f:
+        head = f.read(max(len(magic) for magic, _ in COMPRESSION_MAGICS))
+    for magic, module_name in COMPRESSION_MAGICS:
+        if head.startswith(magic):
+            return module_name
+    return None
+
+def open_compressed(filename, module_name):
+    if module_name == "gzip":
+        import gzip
+        return gzip.GzipFile(filename, "rb")
+    elif module_name == "bz2":
+        import bz2
+        return bz2.BZ2File(filename, "rb")
+    elif module_name == "lzma":
+        import lzma             # Python 3.3+
+        return lzma.LZMAFile(filename, "rb")
+    raise ValueError("Unknown compression: " + str(module_name))
+
+# ============================================================ #
+# Multiple files
+# ============================================================ #
+
+class MultiFileReader(object):
+    """
+    Reads several files concurrently with a small pool of threads.
+    Files are read ahead in parallel, but lines are yielded in a fixed
+    order (files in the given order, lines of each file in order), so
+    that indices of lines are the same on every run. Hence a slow file
+    (e.g., on NFS) holds back the files after it, though they are read
+    meanwhile. An error in reading a file is raised after the lines
+    read before it. The origin (file
+    name and line number) of each yielded line is recorded per chunk,
+    so it can be looked up from the index of the line.
+    """
+
+    thread_count = 4
+    chunk_size = 1024
+    queued_chunk_count = 64
+
+    def __init__(self, filenames, read_lines):
+        self.filenames = filenames
+        self.read_lines = read_lines
+        self.chunk_heads = []   # index of the first line of each chunk
+        self.chunk_origins = [] # (file index, line number of the first line)
+        self.line_count = 0
+        self.reversed = False
+
+    def read_file(self, file_index, chunks):
+        lines = self.read_lines(self.filenames[file_index])
+        line_number = 1
+        try:
+            while True:
+                chunk = list(islice(lines, self.chunk_size))
+                if not chunk:
+                    break
+                chunks.put((line_number, chunk))
+                line_number += len(chunk)
+        except Exception as e:
+            debug.log("MultiFileReader", "{0}: {1}".format(self.filenames[file_index], e))
+            # raised by __iter__ when the lines before the error are
+            # yielded, as reading a single file does
+            chunks.put((line_number, e))
+            return
+        chunks.put((line_number, None))
+
+    def start_readers(self):
+        """
+        Returns a queue of chunks for each file. Files are taken by the
+        threads in the given order, so the file being yielded is always
+        being read (or already read).
+        """
+        file_indices = queue.Queue()
+        for file_index in six.moves.range(len(self.filenames)):
+            file_indices.put(file_index)
+        file_chunks = [queue.Queue(self.queued_chunk_count) for filename in self.filenames]
+
+        def read_files():
+            while True:
+                try:
+                    file_index = file_indices.get_nowait()
+                except queue.Empty:
+                    return
+                self.read_file(file_index, file_chunks[file_index])
+
+        for i in six.moves.range(min(self.thread_count, len(self.filenames))):
+            reader = threading.Thread(target = read_files)
+            reader.daemon = True
+            reader.start()
+
+        return file_chunks
+
+    def __iter__(self):
+        for file_index, chunks in enumerate(self.start_readers()):
+            while True:
+                line_number, chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                self.chunk_heads.append(self.line_count)
+                self.chunk_origins.append((file_index, line_number))
+                self.line_count += len(chunk)
+                for line in chunk:
+                    yield line
+
+    def iter_lines(self, reverse = False):
+        if reverse:
+            lines = list(self)
+            self.reversed = True
+            return reversed(lines)
+        return iter(self)
+
+    def get_origin(self, index):
+        """
+        Returns (file name, line number) of the `index`-th line
+        """
+        if self.reversed:
+            index = self.line_count - 1 - index
+        chunk_index = bisect_right(self.chunk_heads, index) - 1
+        file_index, line_number = self.chunk_origins[chunk_index]
+        return self.filenames[file_index], line_number + index - self.chunk_heads[chunk_index]
+
+    def format_line_with_origin(self, line, index):
+        filename, line_number = self.get_origin(index)
+        return u"{0}:{1}:{2}".format(filename, line_number, line)
+
+# ============================================================ #
+# Follow (tail -f)
+# ============================================================ #
+
+IN_MODIFY = 0x00000002
+
+def create_inotify_watch(filename):
+    """
+    Returns a file descriptor which becomes readable when `filename`
+    is modified, or None when inotify is not available
+    """
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+        inotify_fd = libc.inotify_init()
+        if inotify_fd < 0:
+            return None
+        if libc.inotify_add_watch(inotify_fd, filename.encode(), IN_MODIFY) < 0:
+            os.close(inotify_fd)
+            return None
+        return inotify_fd
+    except Exception as e:
+        debug.log("create_inotify_watch", e)
+        return None
+
+class FileFollower(object):
+    """
+    Reads lines from a file like `tail -f`. `iter_lines` yields the
+    lines which exist at first, and then a background thread watches
+    the file (with inotify if available, by polling its size
+    otherwise) and queues appended lines, which can be taken by
+    `get_new_lines`.
+
+    A last line without a newline is yielded as well. When appended
+    data continues the line, the new content of the line is taken by
+    `get_changed_last_line`.
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, filename, encoding, line_filter = None):
+        self.filename = filename
+        self.encoding = encoding
+        self.line_filter = line_filter
+        self.offset = 0
+        self.incomplete_line = b""
+        # whether the last yielded (or queued) line is incomplete_line
+        self.incomplete_line_shown = False
+        # number of yielded (or queued) lines, and the indices of lines
+        # which are the first ones of the file (it restarts when truncated)
+        self.line_count = 0
+        self.first_line_indices = [0]
+        self.new_lines = queue.Queue()
+        self.changed_last_line = None
+        self.watcher = None
+        # called (from the watcher thread) when lines are queued
+        self.on_update = None
+
+    def decode_line(self, line):
+        line = line.decode(self.encoding, "replace").rstrip(u"\r")
+        return self.line_filter(line) if self.line_filter else line
+
+    def split_lines(self, data):
+        lines = (self.incomplete_line + data).split(b"\n")
+        self.incomplete_line = lines.pop()
+        self.offset += len(data)
+        for line in lines:
+            yield self.decode_line(line)
+
+    def read_appended_lines(self, f):
+        """
+        Returns (whether the first line replaces the last one, lines)
+        for data appended since the last read. The last line may be
+        incomplete.
+        """
+        f.seek(self.offset)
+        lines = []
+        while True:
+            data = f.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            lines.extend(self.split_lines(data))
+        replaces_last = self.incomplete_line_shown and (lines or self.incomplete_line)
+        if self.incomplete_line:
+            lines.append(self.decode_line(self.incomplete_line))
+        self.incomplete_line_shown = bool(self.incomplete_line)
+        self.line_count += len(lines) - (1 if replaces_last else 0)
+        return bool(replaces_last), lines
+
+    def iter_lines(self):
+        with open(self.filename, "rb") as f:
+            replaces_last, lines = self.read_appended_lines(f)
+        # lines are pulled lazily (only the ones on the screen for the
+        # empty query), so watch the file before the first one
+        self.start_watching()
+        for line in lines:
+            yield line
+
+    def start_watching(self):
+        if self.watcher is None:
+            self.watcher = threading.Thread(target = self.watch)
+            self.watcher.daemon = True
+            self.watcher.start()
+
+    def watch(self):
+        inotify_fd = create_inotify_watch(self.filename)
+        with open(self.filename, "rb") as f:
+            while True:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.offset:
+                    # truncated (e.g., rotated by copytruncate); the
+                    # last line is left as it is
+                    self.offset = 0
+                    self.incomplete_line = b""
+                    self.incomplete_line_shown = False
+                    self.first_line_indices.append(self.line_count)
+                if size > self.offset:
+                    replaces_last, lines = self.read_appended_lines(f)
+                    if lines:
+                        self.new_lines.put((replaces_last, lines))
+                        if self.on_update:
+                            self.on_update()
+                # wait for modification
+                if inotify_fd is None:
+                    time.sleep(self.poll_interval)
+                elif select.select([inotify_fd], [], [], self.poll_interval)[0]:
+                    os.read(inotify_fd, 4096)
+
+    def get_new_lines(self):
+        """
+        Returns lines appended since the last call (without blocking).
+        Call `get_changed_last_line` then, before the lines are added.
+        """
+        lines = []
+        while True:
+            try:
+                replaces_last, appended_lines = self.new_lines.get_nowait()
+            except queue.Empty:
+                return lines
+            if replaces_last:
+                if lines:
+                    lines[-1] = appended_lines[0]
+                else:
+                    self.changed_last_line = appended_lines[0]
+                appended_lines = appended_lines[1:]
+            lines.extend(appended_lines)
+
+    def get_changed_last_line(self):
+        """
+        Returns the new content of the last line taken before the last
+        `get_new_lines` call, when the line was continued (None
+        otherwise)
+        """
+        line, self.changed_last_line = self.changed_last_line, None
+        return line
+
+    def format_line_with_origin(self, line, index):
+        first_index = self.first_line_indices[bisect_right(self.first_line_indices, index) - 1]
+        return u"{0}:{1}:{2}".format(self.filename, index - first_index + 1, line)
+
+# ============================================================ #
+# Streamed input (pipes)
+# ============================================================ #
+
+class StreamFeed(object):
+    """
+    Reads lines from a pipe (e.g., stdin) without blocking, so that a
+    producer which pauses never blocks the interface. `iter_lines`
+    yields the lines available at first, and then the event loop of
+    Percol watches `fileno()` and takes lines by `get_new_lines` when
+    the pipe becomes readable, until `closed` becomes true.
+    """
+
+    # bytes read by one get_new_lines call, so that keys are handled
+    # between reads of a fast producer
+    read_limit = 4 * READ_BLOCK_SIZE
+
+    def __init__(self, get_fd, encoding, line_filter = None):
+        # the descriptor is taken when lines are read first (stdin is
+        # replaced after the tty is opened)
+        self.get_fd = get_fd
+        self.fd = None
+        self.decoder = codecs.getincrementaldecoder(encoding)("replace")
+        self.line_filter = line_filter
+        self.incomplete_line = u""
+        self.closed = False
+        # not used (the event loop watches the descriptor)
+        self.on_update = None
+
+    def fileno(self):
+        if self.fd is None:
+            import fcntl
+            self.fd = self.get_fd()
+            flags = fcntl.fcntl(self.fd, fcntl.F_GETFL)
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        return self.fd
+
+    def split_lines(self, text):
+        lines = (self.incomplete_line + text).split(u"\n")
+        self.incomplete_line = lines.pop()
+        if self.closed and self.incomplete_line:
+            lines.append(self.incomplete_line)
+            self.incomplete_line = u""
+        for line in lines:
+            line = line.rstrip(u"\r")
+            yield self.line_filter(line) if self.line_filter else line
+
+    def get_new_lines(self):
+        """
+        Returns lines read without blocking
+        """
+        if self.closed:
+            return []
+        fd = self.fileno()
+        chunks = []
+        read_size = 0
+        while read_size < self.read_limit:
+            try:
+                data = os.read(fd, READ_BLOCK_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
+            if not data:
+                self.closed = True
+                break
+            chunks.append(self.decoder.decode(data))
+            read_size += len(data)
+        if self.closed:
+            chunks.append(self.decoder.decode(b"", True))
+        return list(self.split_lines(u"".join(chunks)))
+
+    def iter_lines(self):
+        for line in self.get_new_lines():
+            yield line
+
+# ============================================================ #
+# Shell history
+# ============================================================ #
+
+def map_file(filename):
+    """
+    Returns the content of `filename` as a read-only mmap (or bytes
+    when the file cannot be mapped, e.g., it is empty or a pipe)
+    """
+    import mmap
+    with open(filename, "rb") as f:
+        try:
+            # the mapping stays after the file is closed
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return f.read()
+
+BACKWARD_BLOCK_SIZE = 1 << 16
+
+def iter_lines_backward(data, block_size = BACKWARD_BLOCK_SIZE):
+    """
+    Yields lines (without newlines) of `data` from the last one. `data`
+    is split block by block from its end, so that only blocks actually
+    consumed are touched.
+    """
+    end = len(data)
+    if data[end - 1:end] == b"\n":
+        end -= 1
+    rest = b""                  # head of a line continuing to the later block
+    while end > 0:
+        start = max(end - block_size, 0)
+        lines = (data[start:end] + rest).split(b"\n")
+        if start > 0:
+            # may be a part of the line
+            rest = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+        end = start
+
+ZSH_META = 0x83
+
+def unmetafy_zsh(entry):
+    """
+    zsh stores some bytes as META followed by the byte xor 32
+    """
+    if b"\x83" not in entry:
+        return entry
+    result = bytearray()
+    entry_bytes = iter(bytearray(entry))
+    for byte in entry_bytes:
+        if byte == ZSH_META:
+            byte = next(entry_bytes, 0) ^ 32
+        result.append(byte)
+    return bytes(result)
+
+zsh_extended_history_pattern = re.compile(br": *\d+:\d+;")
+
+def iter_zsh_history_entries(data):
+    """
+    Yields entries of a zsh history file from the newest one. Lines of
+    a multiline entry end with a backslash except the last one, and
+    entries written with EXTENDED_HISTORY start with ": TIME:ELAPSED;".
+    """
+    entry_lines = []          # lines of the current entry (reversed)
+    for line in iter_lines_backward(data):
+        if entry_lines and line.endswith(b"\\"):
+            # continues to the following line
+            entry_lines.append(line[:-1])
+            continue
+        if entry_lines:
+            yield join_entry_lines(entry_lines)
+        entry_lines = [line]
+    if entry_lines:
+        yield join_entry_lines(entry_lines)
+
+def join_entry_lines(reversed_lines):
+    if len(reversed_lines) == 1:
+        return reversed_lines[0]
+    return b"\n".join(reversed(reversed_lines))
+
+def parse_zsh_history_entry(entry):
+    entry = unmetafy_zsh(entry)
+    if entry.startswith(b":"):
+        metadata = zsh_extended_history_pattern.match(entry)
+        if metadata:
+            entry = entry[metadata.end():]
+    return entry
+
+bash_timestamp_pattern = re.compile(br"#\d+$")
+
+def iter_bash_history_entries(data):
+    """
+    Yields entries of a bash history file from the newest one. When
+    HISTTIMEFORMAT is set, bash writes a "#TIME" line before each entry
+    and an entry may span lines (with the lithist option).
+    """
+    newline = data.find(b"\n")
+    first_line = data[:newline] if newline >= 0 else data[:]
+    if not bash_timestamp_pattern.match(first_line):
+        for line in iter_lines_backward(data):
+            yield line
+        return
+    entry_lines = []
+    for line in iter_lines_backward(data):
+        if bash_timestamp_pattern.match(line):
+            if entry_lines:
+                yield join_entry_lines(entry_lines)
+            entry_lines = []
+        else:
+            entry_lines.append(line)
+    if entry_lines:
+        yield join_entry_lines(entry_lines)
+
+HISTORY_SHELLS = {
+    # shell => (default history file, entry iterator, entry parser)
+    "zsh": ("~/.zsh_history", iter_zsh_history_entries, parse_zsh_history_entry),
+    "bash": ("~/.bash_history", iter_bash_history_entries, None),
+}
+
+def iter_history(shell, filename = None, encoding = "utf-8"):
+    """
+    Returns an iterator of commands in the history of `shell` from the
+    newest one, skipping older duplicates. Newlines in multiline commands are shown
+    as "\\n" (like `fc -l -n`).
+    """
+    default_filename, iter_entries, parse_entry = HISTORY_SHELLS[shell]
+    # fails here (not on the first candidate) when the file is missing
+    data = map_file(os.path.expanduser(filename or default_filename))
+    return iter_history_commands(iter_entries(data), parse_entry, encoding)
+
+def iter_history_commands(entries, parse_entry, encoding):
+    seen = set()
+    for entry in entries:
+        if parse_entry:
+            entry = parse_entry(entry)
+        if not entry.strip() or entry in seen:
+            continue
+        seen.add(entry)
+        if b"\n" in entry:
+            entry = entry.replace(b"\n", b"\\n")
+        yield entry.decode(encoding, "replace")
+
+# ============================================================ #
+# Sources
+# ============================================================ #
+
+SOURCE_NAMES = ("zsh-history", "bash-history", "files", "dirs", "procs")
+
+# sources which can be refreshed periodically
+REFRESHABLE_SOURCE_NAMES = ("procs",)
+
+def open_source(spec, encoding, prune_patterns = None):
+    """
+    Returns candidates of the source given as NAME[:ARGUMENT] (e.g.,
+    "zsh-history:~/.histfile" or "files:src")
+    """
+    name, _, argument = spec.partition(":")
+    if name in ("zsh-history", "bash-history"):
+        return iter_history(name.split("-")[0], argument or None, encoding)
+    if name in ("files", "dirs"):
+        from percol.lazyarray import LazyArray
+        from percol.walker import DirectoryWalker, CompressedPaths, DEFAULT_PRUNE_PATTERNS
+        root = argument or u"."
+        if not os.path.isdir(root):
+            raise IOError("Not a directory: " + root)
+        walker = DirectoryWalker(root, name,
+                                 DEFAULT_PRUNE_PATTERNS + tuple(prune_patterns or ()))
+        return LazyArray(walker, CompressedPaths())
+    if name == "procs":
+        return open_refreshed_source(spec, encoding, None).iter_lines()
+    raise ValueError("Unknown source: " + name)
+
+def open_refreshed_source(spec, encoding, refresh_interval):
+    """
+    Returns a candidate feed (see Percol.candidate_feed) of the source,
+    whose iter_lines() returns the first candidates
+    """
+    name, _, argument = spec.partition(":")
+    if name == "procs":
+        from percol.procs import ProcessList
+        return ProcessList(encoding, refresh_interval)
+    raise ValueError("Source cannot be refreshed: " + name)
@@ -5,8 +5,6 @@ import curses
 import six
 import math
 
-from itertools import islice
-
 from percol import display, debug
 
 class SelectorView(object):
@@ -14,6 +12,13 @@ class SelectorView(object):
         self.percol  = percol
         self.screen  = percol.screen
         self.display = percol.display
+        self.line_columns_cache = {}
+        # contents of result rows drawn in the last frame (y => row)
+        self.frame_rows = {}
+        # compiled prompt formats (format => PromptTemplate)
+        self.prompt_templates = {}
+        # (candidate, lines) shown in the preview pane
+        self.preview_frame = None
 
     CANDIDATES_LINE_BASIC    = ("on_default", "default")
     CANDIDATES_LINE_SELECTED = ("underline", "on_magenta", "white")
@@ -21,6 +26,42 @@ class SelectorView(object):
     CANDIDATES_LINE_QUERY    = ("yellow", "bold")
     MESSAGE_ERROR            = ("on_red", "white")
 
+    # ============================================================ #
+    # Styles
+    # ============================================================ #
+
+    STYLE_NAMES = ("CANDIDATES_LINE_BASIC", "CANDIDATES_LINE_SELECTED", "CANDIDATES_LINE_MARKED",
+                   "CANDIDATES_LINE_QUERY", "MESSAGE_ERROR")
+
+    # curses attributes resolved from the styles above
+    line_styles = None
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.STYLE_NAMES:
+            self.line_styles = None
+
+    def refresh_styles(self):
+        """
+        Resolves style specifiers into curses attributes. Called
+        automatically when a style is set to the view, and should be
+        called after changing styles of the class.
+        """
+        to_style = self.display.attrs_to_style
+        query_style = tuple(self.CANDIDATES_LINE_QUERY)
+        # (line style, keyword style) for basic, selected and marked lines
+        self.line_styles = tuple((to_style(line_style), to_style(query_style + tuple(line_style)))
+                                 for line_style in (self.CANDIDATES_LINE_BASIC,
+                                                    self.CANDIDATES_LINE_SELECTED,
+                                                    self.CANDIDATES_LINE_MARKED))
+        self.error_style = to_style(self.MESSAGE_ERROR)
+        # rows should be drawn with the new styles
+        self.frame_rows = {}
+        self.preview_frame = None
+
+    def get_line_styles(self, is_current, is_marked):
+        return self.line_styles[1 if is_current else 2 if is_marked else 0]
+
     @property
     def RESULTS_DISPLAY_MAX(self):
         return self.display.Y_END - self.display.Y_BEGIN
@@ -45,38 +86,48 @@ class SelectorView(object):
     def absolute_page_tail(self):
         return self.absolute_page_head + self.RESULTS_DISPLAY_MAX
 
+    def invalidate_display(self):
+        """
+        Forgets the last frame so that the next refresh redraws everything
+        """
+        self.frame_rows = {}
+        self.preview_frame = None
+        self.display.erase()
+
     def refresh_display(self):
-        with self.percol.global_lock:
-            self.display.erase()
-            self.display_results()
-            self.display_prompt()
-            self.display.refresh()
+        if self.line_styles is None:
+            self.refresh_styles()
+        self.display_results()
+        self.display_preview()
+        self.display_prompt()
+        self.display.refresh()
 
     def display_line(self, y, x, s, style = None):
         if style is None:
-            style = self.CANDIDATES_LINE_BASIC
+            style = self.get_line_styles(False, False)[0]
         self.display.add_aligned_string(s, y_offset = y, x_offset = x, style = style, fill = True)
 
     def display_result(self, y, result, is_current = False, is_marked = False):
         line, find_info, abs_idx = result
 
-        if is_current:
-            line_style = self.CANDIDATES_LINE_SELECTED
-        elif is_marked:
-            line_style = self.CANDIDATES_LINE_MARKED
-        else:
-            line_style = self.CANDIDATES_LINE_BASIC
+        line_style, keyword_style = self.get_line_styles(is_current, is_marked)
 
-        keyword_style = self.CANDIDATES_LINE_QUERY + line_style
+        # only the visible part of the line is measured and drawn
+        line_head = self.get_visible_line_head(line, find_info)
+        line = line[line_head:line_head + self.display.WIDTH]
 
         self.display_line(y, 0, line, style = line_style)
 
         if find_info is None:
             return
+        columns = self.get_line_columns(line)
         for (subq, match_info) in find_info:
             for x_offset, subq_len in match_info:
+                x_offset -= line_head
+                if not 0 <= x_offset < len(line):
+                    continue
                 try:
-                    x_offset_real = display.screen_len(line, beg = 0, end = x_offset)
+                    x_offset_real = columns[x_offset]
                     self.display.add_string(line[x_offset:x_offset + subq_len],
                                             pos_y = y,
                                             pos_x = x_offset_real,
@@ -84,23 +135,64 @@ class SelectorView(object):
                 except curses.error as e:
                     debug.log("addnstr", str(e) + " ({0})".format(y))
 
+    def get_visible_line_head(self, line, find_info):
+        """
+        Returns the offset of the first character shown for `line`.
+        When the first match lies beyond the right edge of the screen,
+        the line is shifted so that the match comes to the center.
+        """
+        width = self.display.WIDTH
+        if len(line) <= width or not find_info:
+            return 0
+        try:
+            first_match, match_len = min(match for (subq, match_info) in find_info
+                                         for match in match_info)
+        except ValueError:
+            return 0
+        match_end = first_match + match_len
+        if match_end <= width and display.screen_len(line, 0, match_end) <= width:
+            return 0
+        return max(first_match - width // 2, 0)
+
+    # Screen columns of characters are cached for lines shown recently
+    LINE_COLUMNS_CACHE_SIZE = 1024
+
+    def get_line_columns(self, line):
+        columns = self.line_columns_cache.get(line)
+        if columns is None:
+            if len(self.line_columns_cache) >= self.LINE_COLUMNS_CACHE_SIZE:
+                self.line_columns_cache.clear()
+            columns = self.line_columns_cache[line] = display.screen_columns(line)
+        return columns
+
     def display_error_message(self, message):
-        self.display_line(self.RESULTS_OFFSET_V, 0, message, style=self.MESSAGE_ERROR)
+        self.display_line(self.RESULTS_OFFSET_V, 0, message, style=self.error_style)
 
     def display_results(self):
         result_vertical_pos = self.RESULTS_OFFSET_V
         result_pos_direction = 1 if self.results_top_down else -1
 
-        results_in_page = islice(enumerate(self.model.results), self.absolute_page_head, self.absolute_page_tail)
+        results = self.model.results
+        drawn_rows = {}
 
         try:
-            for cand_nth, result in results_in_page:
+            for cand_nth in six.moves.range(self.absolute_page_head, self.absolute_page_tail):
                 try:
-                    self.display_result(result_vertical_pos, result,
-                                        is_current = cand_nth == self.model.index,
-                                        is_marked = self.model.get_is_marked(cand_nth))
-                except curses.error as e:
-                    debug.log("display_results", str(e))
+                    result = results[cand_nth]
+                except IndexError:
+                    break
+                is_current = cand_nth == self.model.index
+                is_marked = result[2] in self.model.marks
+                # redraw the row only when its content has changed
+                row = (result, is_current, is_marked)
+                drawn_rows[result_vertical_pos] = row
+                if self.frame_rows.get(result_vertical_pos) != row:
+                    try:
+                        self.display_result(result_vertical_pos, result,
+                                            is_current = is_current,
+                                            is_marked = is_marked)
+                    except curses.error as e:
+                        debug.log("display_results", str(e))
                 result_vertical_pos += result_pos_direction
         except Exception as e:
             # debug.log("display_results", str(e))
@@ -114,6 +206,44 @@ class SelectorView(object):
                       ))
             exception_raw_string = str(e).decode(self.percol.encoding) if six.PY2 else str(e)
             self.display_error_message("Error at line " + str(cand_nth) + ": " + exception_raw_string)
+            drawn_rows[self.RESULTS_OFFSET_V] = None
+
+        # clear rows which are no longer used
+        for y in self.frame_rows:
+            if y not in drawn_rows:
+                self.display.clear_line(y)
+        self.frame_rows = drawn_rows
+
+    # ============================================================ #
+    # Preview
+    # ============================================================ #
+
+    PREVIEW_LOADING = [u"loading..."]
+
+    def display_preview(self):
+        previewer = self.percol.previewer
+        if previewer is None or self.display.preview_area is None:
+            return
+        candidate = self.percol.model_candidate.get_selected_result()
+        if candidate is None:
+            lines = []
+        else:
+            lines = previewer.get(candidate) or self.PREVIEW_LOADING
+        # redraw the pane only when its content has changed
+        frame = self.preview_frame
+        if frame is not None and frame[0] == candidate and frame[1] is lines:
+            return
+        self.preview_frame = (candidate, lines)
+
+        style = self.get_line_styles(False, False)[0]
+        self.display.draw_preview_border(style)
+        height = self.display.preview_area[2]
+        for row in six.moves.range(height):
+            self.display.add_preview_line(row, lines[row] if row < len(lines) else u"", style)
+
+    # ============================================================ #
+    # Results
+    # ============================================================ #
 
     results_top_down = True
 
@@ -146,20 +276,30 @@ class SelectorView(object):
             return self.display.Y_END
 
     PROMPT  = u"QUERY> %q"
-    RPROMPT = u"(%i/%I) [%n/%N]"
+    RPROMPT = u"%s(%i/%I) [%n/%N]"
+
+    PROMPT_TEMPLATES_CACHE_SIZE = 16
+
+    def get_prompt_template(self, format):
+        template = self.prompt_templates.get(format)
+        if template is None:
+            if len(self.prompt_templates) >= self.PROMPT_TEMPLATES_CACHE_SIZE:
+                self.prompt_templates.clear()
+            template = self.prompt_templates[format] = PromptTemplate(format, self.display)
+        return template
 
     def do_display_prompt(self, format,
                           y_offset = 0, x_offset = 0,
                           y_align = "top", x_align = "left"):
-        parsed = self.display.markup_parser.parse(format)
+        template = self.get_prompt_template(format)
         offset = 0
         tokens = []
 
         self.last_query_position = -1
 
-        for s, attrs in parsed:
-            formatted_string = self.format_prompt_string(s, offset)
-            tokens.append((formatted_string, attrs))
+        for parts, style in template.tokens:
+            formatted_string = self.format_prompt_parts(parts, offset)
+            tokens.append((formatted_string, style))
             offset += display.screen_len(formatted_string)
 
         y, x = self.display.add_aligned_string_tokens(tokens,
@@ -177,6 +317,8 @@ class SelectorView(object):
         self.caret_x = -1
         self.caret_y = -1
 
+        self.display.clear_line(self.PROMPT_OFFSET_V)
+
         self.do_display_prompt(self.RPROMPT,
                                y_offset = self.PROMPT_OFFSET_V,
                                x_align = "right")
@@ -192,15 +334,20 @@ class SelectorView(object):
         except curses.error:
             pass
 
-    def handle_format_prompt_query(self, matchobj, offset):
-        # -1 is from first '%' of %([a-zA-Z%])
-        self.last_query_position = matchobj.start(1) - 1 + offset
+    @property
+    def status_string(self):
+        if self.model.seeking:
+            return u"seeking... "
+        return u""
+
+    def handle_format_prompt_query(self, column):
+        self.last_query_position = column
         return self.model.query
 
     prompt_replacees = {
         "%" : lambda self, **args: "%",
         # display query and caret
-        "q" : lambda self, **args: self.handle_format_prompt_query(args["matchobj"], args["offset"]),
+        "q" : lambda self, **args: self.handle_format_prompt_query(args["column"]),
         # display query but does not display caret
         "Q" : lambda self, **args: self.model.query,
         "n" : lambda self, **args: self.page_number,
@@ -208,18 +355,60 @@ class SelectorView(object):
         "i" : lambda self, **args: self.model.index + (1 if self.model.results_count > 0 else 0),
         "I" : lambda self, **args: self.model.results_count,
         "c" : lambda self, **args: self.model.caret,
-        "k" : lambda self, **args: self.percol.last_key
+        "k" : lambda self, **args: self.percol.last_key,
+        "s" : lambda self, **args: self.status_string
     }
 
-    format_pattern = re.compile(u'%([a-zA-Z%])')
-    def format_prompt_string(self, s, offset = 0):
-        def formatter(matchobj):
-            al = matchobj.group(1)
-            if al in self.prompt_replacees:
-                res = self.prompt_replacees[al](self, matchobj = matchobj, offset = offset)
-                return (res if isinstance(res, six.text_type)
-                        else six.text_type(res))
+    def format_prompt_parts(self, parts, offset = 0):
+        """
+        Expands format specifiers in parts of a compiled prompt.
+        Replacees receive the match object of the specifier, the
+        screen column of the token (offset) and of the specifier
+        (column).
+        """
+        strings = []
+        column = offset
+        for literal, specifier, matchobj in parts:
+            if specifier is None:
+                s = literal
+            elif specifier in self.prompt_replacees:
+                res = self.prompt_replacees[specifier](self, matchobj = matchobj,
+                                                       offset = offset, column = column)
+                s = res if isinstance(res, six.text_type) else six.text_type(res)
             else:
-                return u""
+                s = u""
+            strings.append(s)
+            column += display.screen_len(s)
+        return u"".join(strings)
+
+# ============================================================ #
+# Prompt template
+# ============================================================ #
+
+class PromptTemplate(object):
+    """
+    A prompt format compiled once. `tokens` is a list of (parts,
+    style) for each markup token, where style is a curses attribute
+    and each part is (literal, None, None) or (None, specifier,
+    matchobj) for a format specifier like %q.
+    """
+
+    format_pattern = re.compile(u'%([a-zA-Z%])')
 
-        return re.sub(self.format_pattern, formatter, s)
+    def __init__(self, format, display):
+        self.format = format
+        self.tokens = []
+        for s, attrs in display.markup_parser.parse(format):
+            self.tokens.append((self.compile_string(s), display.attrs_to_style(attrs)))
+
+    def compile_string(self, s):
+        parts = []
+        pos = 0
+        for matchobj in self.format_pattern.finditer(s):
+            if matchobj.start() > pos:
+                parts.append((s[pos:matchobj.start()], None, None))
+            parts.append((None, matchobj.group(1), matchobj))
+            pos = matchobj.end()
+        if pos < len(s):
+            parts.append((s[pos:], None, None))
+        return parts
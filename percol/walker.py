@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import fnmatch
+import threading
+import six
+
+from array import array
+from six.moves import queue
+
+from percol import debug
+
+# ============================================================ #
+# Compressed paths
+# ============================================================ #
+
+class CompressedPaths(object):
+    """
+    List of paths which keeps each directory part once. A path is
+    stored as the index of its directory and its base name, and the
+    path string is built on access. Usable as the storage of LazyArray.
+    """
+
+    def __init__(self):
+        self.directories = []           # with trailing separators
+        self.directory_indices = {}     # directory => index
+        self.path_directories = array("I")
+        self.path_names = []
+        # paths come directory by directory
+        self.last_directory = None
+        self.last_directory_index = None
+
+    def get_directory_index(self, directory):
+        if directory == self.last_directory:
+            return self.last_directory_index
+        index = self.directory_indices.get(directory)
+        if index is None:
+            index = self.directory_indices[directory] = len(self.directories)
+            self.directories.append(directory)
+        self.last_directory = directory
+        self.last_directory_index = index
+        return index
+
+    def append(self, path):
+        separator = path.rfind(u"/", 0, len(path) - 1) + 1
+        self.path_directories.append(self.get_directory_index(path[:separator]))
+        self.path_names.append(path[separator:])
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def __len__(self):
+        return len(self.path_names)
+
+    def __getitem__(self, idx):
+        directories = self.directories
+        if isinstance(idx, slice):
+            return [directories[directory] + name
+                    for directory, name in six.moves.zip(self.path_directories[idx],
+                                                         self.path_names[idx])]
+        return directories[self.path_directories[idx]] + self.path_names[idx]
+
+    def __iter__(self):
+        for idx in six.moves.range(len(self)):
+            yield self[idx]
+
+# ============================================================ #
+# Directory walker
+# ============================================================ #
+
+# directories which are not entered (nor listed) by default
+DEFAULT_PRUNE_PATTERNS = (".git", ".hg", ".svn", ".bzr", "CVS", "_darcs",
+                          "node_modules", "__pycache__", ".tox", ".mypy_cache")
+
+def compile_prune_patterns(patterns):
+    """
+    Returns a function which tells whether a directory (given by its
+    name and its path) is pruned. Patterns are globs matched against
+    the name, or against the path when they contain a slash.
+    """
+    name_patterns = [fnmatch.translate(p) for p in patterns if u"/" not in p]
+    path_patterns = [fnmatch.translate(p.rstrip(u"/")) for p in patterns if u"/" in p]
+    name_regex = re.compile(u"|".join(name_patterns)) if name_patterns else None
+    path_regex = re.compile(u"|".join(path_patterns)) if path_patterns else None
+
+    def is_pruned(name, path):
+        return bool(name_regex and name_regex.match(name) or
+                    path_regex and path_regex.match(path))
+    return is_pruned
+
+def list_directory(path):
+    """
+    Returns (names of non-directories, names of directories) in `path`.
+    Symbolic links to directories are not followed.
+    """
+    files, directories = [], []
+    if hasattr(os, "scandir"):
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks = False):
+                directories.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        import stat
+        for name in os.listdir(path):
+            if stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode):
+                directories.append(name)
+            else:
+                files.append(name)
+    return files, directories
+
+class DirectoryWalker(object):
+    """
+    Walks directories under `root` with a pool of threads and yields
+    paths (files, or directories for `kind` "dirs") as soon as any
+    thread finds them. Paths are relative to `root` (and prefixed with
+    `root` unless it is the current directory). Directories start with
+    `root` itself (like `find ROOT -type d`).
+    """
+
+    thread_count = 4
+    queued_batch_count = 1024
+
+    def __init__(self, root = u".", kind = "files", prune_patterns = DEFAULT_PRUNE_PATTERNS):
+        self.root = root
+        self.kind = kind
+        self.is_pruned = compile_prune_patterns(prune_patterns)
+        if os.path.normpath(root) == u".":
+            self.root_prefix = u""
+        else:
+            self.root_prefix = root.rstrip(u"/") + u"/"
+
+    def walk(self, directories, batches, pending):
+        """
+        Lists directories taken from `directories` and puts found paths
+        into `batches`. `pending` counts directories not listed yet.
+        """
+        while True:
+            prefix = directories.get()
+            if prefix is None:
+                return
+            try:
+                files, subdirectories = list_directory(self.root + u"/" + prefix if prefix else self.root)
+            except OSError as e:
+                debug.log("DirectoryWalker", e)
+                files, subdirectories = [], []
+            entered = [prefix + name for name in subdirectories
+                       if not self.is_pruned(name, prefix + name)]
+            with pending["lock"]:
+                pending["count"] += len(entered)
+            for path in entered:
+                directories.put(path + u"/")
+            if self.kind == "dirs":
+                batches.put([self.root_prefix + path for path in entered])
+            else:
+                batches.put([self.root_prefix + prefix + name for name in files])
+            # the last batch is put before the count reaches zero
+            with pending["lock"]:
+                pending["count"] -= 1
+                finished = pending["count"] == 0
+            if finished:
+                batches.put(None)
+                for i in six.moves.range(self.thread_count):
+                    directories.put(None)
+
+    def __iter__(self):
+        directories = queue.Queue()
+        batches = queue.Queue(self.queued_batch_count)
+        pending = {"lock": threading.Lock(), "count": 1}
+        directories.put(u"")
+        if self.kind == "dirs":
+            yield self.root.rstrip(u"/") or u"/" if self.root_prefix else u"."
+        for i in six.moves.range(self.thread_count):
+            walker = threading.Thread(target = self.walk, args = (directories, batches, pending))
+            walker.daemon = True
+            walker.start()
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            for path in batch:
+                yield path
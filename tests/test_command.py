@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from percol.command import SelectorCommand
+from percol.finder import FinderMultiQueryString
+from percol.model import SelectorModel
+from percol.procs import ProcessList
+
+class FakePercol(object):
+    def call_in_main_thread(self, callback):
+        callback()
+
+class FakeView(object):
+    results_top_down = True
+    RESULTS_DISPLAY_MAX = 10
+
+def process_line(pid, command):
+    return u"{0:<8} {1:>7} {2:>7} {3:<4} {4:>5} {5}".format(u"root", pid, 1, u"S", u"12:00", command)
+
+class SelectIgnoreRefreshTest(unittest.TestCase):
+    def setUp(self):
+        lines = [process_line(10, u"sshd"),
+                 process_line(11, u"[kworker/0:1]"),
+                 process_line(12, u"bash"),
+                 process_line(14, u"vim")]
+        self.model = SelectorModel(percol = FakePercol(), collection = lines,
+                                   finder = FinderMultiQueryString)
+        self.command = SelectorCommand(self.model, FakeView())
+        # skip kernel threads
+        self.command.select_ignore = r".*\s\[.*\]$"
+
+    def get_selected_command(self):
+        return self.model.get_selected_result().split()[-1]
+
+    def test_ignored_line_is_skipped(self):
+        self.command.select_next()
+        self.assertEqual(self.get_selected_command(), u"bash")
+
+    def test_refresh_with_changed_process_list(self):
+        # learn flags and jumps of the current candidates
+        self.command.select_next()
+        self.command.select_previous()
+        self.assertEqual(self.get_selected_command(), u"sshd")
+        # pid 11 exits, and a kernel thread takes the place of bash
+        self.model.replace_collection([process_line(10, u"sshd"),
+                                       process_line(12, u"bash"),
+                                       process_line(13, u"[kworker/1:0]"),
+                                       process_line(14, u"vim")],
+                                      ProcessList.get_line_key)
+        self.assertEqual(self.get_selected_command(), u"sshd")
+        self.command.select_next()
+        self.assertEqual(self.get_selected_command(), u"bash")
+        self.command.select_next()
+        self.assertEqual(self.get_selected_command(), u"vim")
+        self.command.select_previous()
+        self.assertEqual(self.get_selected_command(), u"bash")
+
+    def test_refresh_while_new_query_is_searched(self):
+        # typed, but the search worker has not installed its results yet
+        self.model.query = u"vim"
+        stale_snapshot = self.model.build_snapshot(u"vim")
+        self.model.replace_collection([process_line(10, u"sshd"),
+                                       process_line(14, u"vim"),
+                                       process_line(15, u"vim -R")],
+                                      ProcessList.get_line_key)
+        self.assertFalse(self.model.apply_snapshot(stale_snapshot))
+        self.assertEqual([line.split(None, 5)[-1] for line, _, _ in self.model.results],
+                         [u"vim", u"vim -R"])
+        self.assertFalse(self.model.should_search_again())
+
+if __name__ == "__main__":
+    unittest.main()
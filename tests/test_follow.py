@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pty
+import time
+import fcntl
+import shutil
+import select
+import struct
+import termios
+import tempfile
+import unittest
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCOL = os.path.join(ROOT_DIR, "bin", "percol")
+
+# keys of xterm (in the keypad mode set by curses)
+KEY_END = b"\x1bOF"
+
+class FollowTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "log")
+        with open(self.path, "w") as f:
+            for i in range(1, 501):
+                f.write("big {0}\n".format(i))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def drain(self, master_fd, seconds):
+        until = time.time() + seconds
+        while time.time() < until:
+            if select.select([master_fd], [], [], 0.05)[0]:
+                try:
+                    os.read(master_fd, 65536)
+                except OSError:
+                    return
+
+    def test_appended_line_of_long_file_with_empty_query(self):
+        master_fd, slave_fd = pty.openpty()
+        fcntl.ioctl(slave_fd, termios.TIOCSWINSZ, struct.pack("HHHH", 24, 80, 0, 0))
+        env = dict(os.environ, TERM = "xterm", HOME = self.directory, PYTHONPATH = ROOT_DIR)
+        process = subprocess.Popen([sys.executable, PERCOL, "--tty", os.ttyname(slave_fd),
+                                    "--follow", self.path],
+                                   stdin = slave_fd, stdout = subprocess.PIPE, stderr = slave_fd,
+                                   env = env, preexec_fn = os.setsid)
+        try:
+            # only the first page is pulled from the candidates
+            self.drain(master_fd, 2)
+            with open(self.path, "a") as f:
+                f.write("appended\n")
+            self.drain(master_fd, 1.5)
+            os.write(master_fd, KEY_END)
+            self.drain(master_fd, 0.5)
+            os.write(master_fd, b"\r")
+            self.drain(master_fd, 0.5)
+            output = process.communicate(timeout = 10)[0]
+            self.assertEqual(output, b"appended\n")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            os.close(master_fd)
+            os.close(slave_fd)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from percol.source import (iter_lines_backward, unmetafy_zsh,
+                           iter_zsh_history_entries, parse_zsh_history_entry,
+                           iter_bash_history_entries, iter_history_commands)
+
+class LinesBackwardTest(unittest.TestCase):
+    CASES = [
+        # (data, lines from the last one)
+        (b"", []),
+        (b"a\n", [b"a"]),
+        (b"a\nbb\nccc\n", [b"ccc", b"bb", b"a"]),
+        (b"a\nbb\nccc", [b"ccc", b"bb", b"a"]),
+        (b"a\n\nb\n", [b"b", b"", b"a"]),
+    ]
+
+    def test_lines(self):
+        for data, lines in self.CASES:
+            # small blocks split lines across blocks
+            for block_size in (1, 2, 3, 1 << 16):
+                self.assertEqual(list(iter_lines_backward(data, block_size)), lines,
+                                 (data, block_size))
+
+class UnmetafyZshTest(unittest.TestCase):
+    CASES = [
+        (b"", b""),
+        (b"ls -l", b"ls -l"),
+        # U+30A2 (e3 82 a2) is stored with its last byte metafied
+        (b"echo \xe3\x82\x83\x82", u"echo ア".encode("utf-8")),
+        (b"\x83\xa3\x83\xa3", b"\x83\x83"),
+        # broken META at the end
+        (b"a\x83", b"a\x20"),
+    ]
+
+    def test_unmetafy(self):
+        for entry, expected in self.CASES:
+            self.assertEqual(unmetafy_zsh(entry), expected, entry)
+
+class ZshHistoryTest(unittest.TestCase):
+    CASES = [
+        # (file content, commands from the newest one)
+        (b"", []),
+        (b"ls\n", [u"ls"]),
+        (b"ls\ncd /tmp\nls\n", [u"ls", u"cd /tmp"]),
+        (b"ls\n\n  \nmake\n", [u"make", u"ls"]),
+        # EXTENDED_HISTORY
+        (b": 1600000000:0;ls -l\n: 1600000001:3;make\n", [u"make", u"ls -l"]),
+        (b": 1600000000:0;ls\n: 1600000001:0;ls\n", [u"ls"]),
+        # multiline entries (without the last newline)
+        (b"echo a\\\nb\nls\n", [u"ls", u"echo a\\nb"]),
+        (b": 1:0;for i in 1 2\\\ndo echo $i\\\ndone\nls",
+         [u"ls", u"for i in 1 2\\ndo echo $i\\ndone"]),
+        # a backslash at the end of the last line
+        (b"ls\necho \\\n", [u"echo \\", u"ls"]),
+        (b"echo \xe3\x82\x83\x82\n", [u"echo ア"]),
+    ]
+
+    def test_commands(self):
+        for data, commands in self.CASES:
+            entries = iter_zsh_history_entries(data)
+            self.assertEqual(list(iter_history_commands(entries, parse_zsh_history_entry, "utf-8")),
+                             commands, data)
+
+class BashHistoryTest(unittest.TestCase):
+    CASES = [
+        (b"", []),
+        (b"ls", [u"ls"]),
+        (b"ls\ncd\nls\n", [u"ls", u"cd"]),
+        (b"ls\ncd\nls\ncd\n", [u"cd", u"ls"]),
+        # HISTTIMEFORMAT (and lithist)
+        (b"#1600000000\nls\n#1600000001\necho a\nb\n#1600000002\nls\n",
+         [u"ls", u"echo a\\nb"]),
+        (b"#1600000000\n#1600000001\nls\n", [u"ls"]),
+        # "#..." entries are commands without timestamps
+        (b"ls\n#1600000000\n", [u"#1600000000", u"ls"]),
+    ]
+
+    def test_commands(self):
+        for data, commands in self.CASES:
+            entries = iter_bash_history_entries(data)
+            self.assertEqual(list(iter_history_commands(entries, None, "utf-8")), commands, data)
+
+if __name__ == "__main__":
+    unittest.main()
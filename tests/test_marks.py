@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from percol.finder import FinderMultiQueryString
+from percol.marks import Marks
+from percol.model import SelectorModel
+
+class FakePercol(object):
+    def call_in_main_thread(self, callback):
+        callback()
+
+CANDIDATES = [u"apple", u"banana", u"cherry", u"avocado", u"blueberry", u"apricot"]
+
+class MarksTest(unittest.TestCase):
+    def test_marks_are_iterated_in_index_order(self):
+        marks = Marks()
+        for index in (9, 2, 5):
+            marks.set(index, True)
+        marks.set(5, False)
+        self.assertEqual(list(marks), [2, 9])
+        self.assertTrue(2 in marks)
+        self.assertFalse(5 in marks)
+
+    def test_ranges(self):
+        marks = Marks()
+        marks.set_range(0, 4, True)
+        marks.invert_range(2, 6)
+        self.assertEqual(list(marks), [0, 1, 4, 5])
+        marks.clear()
+        self.assertFalse(marks)
+
+class ModelMarksTest(unittest.TestCase):
+    def setUp(self):
+        self.model = SelectorModel(percol = FakePercol(), collection = CANDIDATES,
+                                   finder = FinderMultiQueryString)
+
+    def search(self, query):
+        self.model.query = query
+        self.model.do_search(query)
+
+    def get_results(self):
+        return [result[0] for result in self.model.results]
+
+    def get_selected(self):
+        return [line for line, _, _ in self.model.iter_selected_results_with_index()]
+
+    def test_marks_survive_searches_and_are_output_in_input_order(self):
+        self.model.set_is_marked(True, 4)               # blueberry
+        self.search(u"a")
+        self.assertEqual(self.get_results(), [u"apple", u"banana", u"avocado", u"apricot"])
+        self.model.set_is_marked(True, 1)               # banana
+        self.model.set_is_marked(True, 0)               # apple
+        self.search(u"ap")
+        self.assertEqual(self.get_results(), [u"apple", u"apricot"])
+        self.assertTrue(self.model.get_is_marked(0))
+        # toggles the results only (apple off, apricot on)
+        self.model.toggle_all_marked()
+        self.assertEqual(self.get_selected(), [u"banana", u"blueberry", u"apricot"])
+        self.search(u"")
+        self.assertEqual(self.get_selected(), [u"banana", u"blueberry", u"apricot"])
+
+    def test_set_all_marked_with_empty_query(self):
+        self.model.set_all_marked(True)
+        self.search(u"b")
+        self.model.set_all_marked(False)
+        self.assertEqual(self.get_selected(), [u"apple", u"cherry", u"avocado", u"apricot"])
+
+    def test_current_result_without_marks(self):
+        self.search(u"ch")
+        self.assertEqual(self.get_selected(), [u"cherry"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pty
+import time
+import select
+import shutil
+import signal
+import tempfile
+import unittest
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCOL = os.path.join(ROOT_DIR, "bin", "percol")
+
+# Runs in a new session whose controlling terminal is argv[1], like an
+# interactive shell: starts `percol --server` as a background job, and
+# then `percol --client` in the foreground
+SESSION_SCRIPT = r"""
+import os, sys, time, fcntl, termios, subprocess
+tty_name, socket_path, candidates_path = sys.argv[1:4]
+tty_fd = os.open(tty_name, os.O_RDWR)
+fcntl.ioctl(tty_fd, termios.TIOCSCTTY, 0)
+os.tcsetpgrp(tty_fd, os.getpgrp())
+server = subprocess.Popen([sys.executable, sys.argv[4], "--server", candidates_path],
+                          stdin = tty_fd, stdout = tty_fd, stderr = tty_fd,
+                          preexec_fn = lambda: os.setpgid(0, 0))
+sys.stdout.write("server={0}\n".format(server.pid))
+sys.stdout.flush()
+while not os.path.exists(socket_path):
+    time.sleep(0.05)
+# requests with options which make percol exit (given after argv[4])
+with open(os.devnull, "w") as devnull:
+    for option in sys.argv[5:]:
+        status = subprocess.call([sys.executable, sys.argv[4], "--client", option, candidates_path],
+                                 stdin = tty_fd, stdout = devnull, stderr = devnull)
+        sys.stdout.write("status={0}\n".format(status))
+        sys.stdout.flush()
+time.sleep(0.2)
+sys.stdout.write("server_alive={0}\n".format(int(server.poll() is None and os.path.exists(socket_path))))
+sys.stdout.flush()
+client = subprocess.Popen([sys.executable, sys.argv[4], "--client", candidates_path],
+                          stdin = tty_fd, stdout = subprocess.PIPE, stderr = tty_fd)
+output = client.communicate()[0]
+server.terminate()
+server.wait()
+sys.stdout.write("output=" + output.decode("utf-8"))
+"""
+
+class BackgroundServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.chmod(self.directory, 0o700)
+        self.socket_path = os.path.join(self.directory, "server.sock")
+        self.candidates_path = os.path.join(self.directory, "candidates")
+        with open(self.candidates_path, "w") as f:
+            f.write("first\nsecond\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_until_exit(self, process, master_fd, timeout):
+        """
+        Reads the terminal (so that writes never block) until `process`
+        exits, and returns its output (None when it did not exit)
+        """
+        until = time.time() + timeout
+        while time.time() < until:
+            if process.poll() is not None:
+                return process.stdout.read().decode("utf-8")
+            if select.select([master_fd], [], [], 0.05)[0]:
+                try:
+                    os.read(master_fd, 65536)
+                except OSError:
+                    pass
+        return None
+
+    def test_background_server_serves_foreground_client(self):
+        self.run_session()
+
+    def test_server_survives_options_which_exit(self):
+        statuses = self.run_session(["--bogus-option", "--help", "--version"])
+        self.assertEqual(statuses, [2, 0, 0])
+
+    def run_session(self, exiting_options = []):
+        """
+        Runs a client in a session with a background server, and
+        returns exit statuses of clients given `exiting_options`
+        """
+        master_fd, slave_fd = pty.openpty()
+        env = dict(os.environ, PERCOL_SOCKET = self.socket_path, TERM = "xterm",
+                   HOME = self.directory, PYTHONPATH = ROOT_DIR)
+        session = subprocess.Popen([sys.executable, "-c", SESSION_SCRIPT, os.ttyname(slave_fd),
+                                    self.socket_path, self.candidates_path, PERCOL] + exiting_options,
+                                   stdout = subprocess.PIPE, env = env,
+                                   preexec_fn = os.setsid)
+        os.close(slave_fd)
+        server_pid = None
+        try:
+            server_pid = int(session.stdout.readline().decode("ascii").split("=")[1])
+            statuses = [int(session.stdout.readline().decode("ascii").split("=")[1])
+                        for option in exiting_options]
+            self.assertEqual(session.stdout.readline(), b"server_alive=1\n")
+            # wait for the first frame, and narrow down to the second line
+            time.sleep(2)
+            os.write(master_fd, b"second")
+            time.sleep(1)
+            os.write(master_fd, b"\r")
+            output = self.read_until_exit(session, master_fd, 15)
+            self.assertIsNotNone(output, "the client (or the server) is stopped")
+            self.assertEqual(output, "output=second\n")
+            return statuses
+        finally:
+            if session.poll() is None:
+                for pgid in (server_pid, session.pid):
+                    try:
+                        os.killpg(pgid, signal.SIGKILL)
+                    except (OSError, TypeError):
+                        pass
+                session.wait()
+            os.close(master_fd)
+
+if __name__ == "__main__":
+    unittest.main()